@@ -0,0 +1,198 @@
+#This file contains the chemical-component parent table used to normalize non-canonical residues.
+#The table (code -> mon_nstd_parent_comp_id) is built once from the wwPDB bulk Chemical Component
+#Dictionary, components.cif(.gz), and stored as a small TSV; the RCSB chemcomp REST API is only asked
+#about codes missing from it. Sequences are normalized over their unique values with one precompiled
+#regex and a code -> letter dictionary, so the full PDB sequence column needs no network.
+#Usage:
+#  python chemcomp_parents.py build components.cif.gz     (or --download to fetch it from wwPDB first)
+import argparse
+import gzip
+import os
+import re
+import shutil
+import numpy as np
+import pandas as pd
+import requests
+from rcsb_cache import fetch_chemcomp
+
+PARENT_TABLE_PATH = 'chemcomp_parents.tsv'
+COMPONENTS_URL = "https://files.wwpdb.org/pub/pdb/data/monomers/components.cif.gz"
+
+# Standard 3-letter -> single-letter dictionary
+standard_3to1 = {
+    "ALA": "A", "CYS": "C", "ASP": "D", "GLU": "E", "PHE": "F",
+    "GLY": "G", "HIS": "H", "ILE": "I", "LYS": "K", "LEU": "L",
+    "MET": "M", "ASN": "N", "PRO": "P", "GLN": "Q", "ARG": "R",
+    "SER": "S", "THR": "T", "VAL": "V", "TRP": "W", "TYR": "Y",
+    "SEC": "U",  # selenocysteine
+    "PYL": "O",  # pyrrolysine
+}
+
+# Regex to find parenthesized text
+pattern = re.compile(r"\((.*?)\)")
+
+
+def _split_parents(value):
+    """'MET' -> ['MET'], '"DA, DG"' -> ['DA', 'DG'], '?' / '.' -> []."""
+    value = value.strip().strip('"\'')
+    if value in ('', '?', '.'):
+        return []
+    return [parent.strip() for parent in value.split(',') if parent.strip()]
+
+
+def parse_components(path):
+    """
+    Stream (code, parents) pairs from components.cif or components.cif.gz.
+
+    Only the data_ header and the _chem_comp.mon_nstd_parent_comp_id item are read.
+    """
+    opener = gzip.open if path.endswith('.gz') else open
+    code = None
+    pending = False
+    with opener(path, 'rt') as cif:
+        for line in cif:
+            if line.startswith('data_'):
+                if code is not None:
+                    yield code, []
+                code = line[5:].strip()
+                pending = False
+            elif code is not None and line.startswith('_chem_comp.mon_nstd_parent_comp_id'):
+                value = line[len('_chem_comp.mon_nstd_parent_comp_id'):].strip()
+                if value:
+                    yield code, _split_parents(value)
+                    code = None
+                else:
+                    pending = True  # Value on the next line
+            elif pending:
+                yield code, _split_parents(line.lstrip(';'))
+                code = None
+                pending = False
+    if code is not None:
+        yield code, []
+
+
+def save_parent_table(parents, path=PARENT_TABLE_PATH):
+    with open(path + '.tmp', 'w') as tsv:
+        for code in sorted(parents):
+            tsv.write(f"{code}\t{','.join(parents[code])}\n")
+    os.replace(path + '.tmp', path)
+
+
+def load_parent_table(path=PARENT_TABLE_PATH):
+    """code -> list of parent codes ([] if the component has none). {} if the table has not been built."""
+    parents = {}
+    try:
+        with open(path, 'r') as tsv:
+            for line in tsv:
+                code, _, value = line.rstrip('\n').partition('\t')
+                parents[code] = value.split(',') if value else []
+    except FileNotFoundError:
+        pass
+    return parents
+
+
+def build_parent_table(components_path, path=PARENT_TABLE_PATH):
+    parents = dict(parse_components(components_path))
+    save_parent_table(parents, path)
+    print(f"Wrote {len(parents)} components ({sum(1 for p in parents.values() if p)} with a parent) to {path}")
+    return parents
+
+
+def download_components(output_path='components.cif.gz'):
+    with requests.get(COMPONENTS_URL, stream=True, timeout=60) as response:
+        response.raise_for_status()
+        with open(output_path, 'wb') as out:
+            shutil.copyfileobj(response.raw, out)
+    return output_path
+
+
+def resolve_parents(codes, path=PARENT_TABLE_PATH, fetch_missing=True):
+    """
+    Parents of every code, from the local table, falling back to the chemcomp REST API.
+
+    Codes looked up over the network are added to the table file.
+
+    Returns:
+        tuple: (dict code -> list of parents ([] if none or unknown), list of (code, error) for failed lookups).
+    """
+    table = load_parent_table(path)
+    parents = {}
+    request_errors = []
+    fetched = {}
+    for code in codes:
+        if not code:
+            parents[code] = []
+        elif code in table:
+            parents[code] = table[code]
+        elif not fetch_missing:
+            parents[code] = []
+        else:
+            try:
+                data = fetch_chemcomp(code, timeout=5)
+            except requests.exceptions.RequestException as e:
+                print(f"Error fetching {code} from RCSB: {e}")
+                request_errors.append((code, str(e)))
+                parents[code] = []
+                continue
+            parent_id = (data or {}).get("chem_comp", {}).get("mon_nstd_parent_comp_id") or []
+            parents[code] = fetched[code] = [parent_id] if isinstance(parent_id, str) else list(parent_id)
+    if fetched:
+        table.update(fetched)
+        save_parent_table(table, path)
+    return parents, request_errors
+
+
+def code_to_letter(code, parents):
+    """Single letter of a non-canonical code: its parent's letter if it has exactly one standard parent, else 'X'."""
+    parent_list = parents.get(code, [])
+    if len(parent_list) == 1 and parent_list[0] in standard_3to1:
+        return standard_3to1[parent_list[0]]
+    return "X"
+
+
+def normalize_sequences(sequences, parents=None, path=PARENT_TABLE_PATH, fetch_missing=True):
+    """
+    Replace every '(CODE)' in the sequences with code_to_letter(CODE).
+
+    Work is done once per unique sequence that contains a '(' and mapped back to every row.
+
+    Args:
+        sequences (pandas.Series): Sequences.
+        parents (dict): code -> parents; resolved with resolve_parents if None.
+
+    Returns:
+        pandas.Series: Normalized sequences, same index.
+    """
+    codes, uniques = pd.factorize(sequences)
+    if len(uniques) == 0:
+        # Empty or all-missing column: nothing to normalize
+        return pd.Series(None, index=sequences.index, name=sequences.name, dtype=object)
+    uniques = np.asarray(uniques, dtype=object)
+    has_code = np.fromiter(('(' in sequence for sequence in uniques), dtype=bool, count=len(uniques))
+    to_normalize = uniques[has_code]
+    found = {match.strip() for sequence in to_normalize for match in pattern.findall(sequence)}
+    if parents is None:
+        parents, _ = resolve_parents(sorted(found), path, fetch_missing)
+    letters = {code: code_to_letter(code, parents) for code in found}
+    uniques[has_code] = [pattern.sub(lambda match: letters[match.group(1).strip()], sequence)
+                         for sequence in to_normalize]
+    normalized = np.where(codes >= 0, uniques[np.maximum(codes, 0)], None)
+    return pd.Series(normalized, index=sequences.index, name=sequences.name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the chemical-component parent table.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build = subparsers.add_parser('build', help="Build the table from components.cif(.gz)")
+    build.add_argument('components', nargs='?', default='components.cif.gz')
+    build.add_argument('--download', action='store_true', help=f"Download {COMPONENTS_URL} first")
+    build.add_argument('--output', default=PARENT_TABLE_PATH)
+    args = parser.parse_args()
+
+    if args.download:
+        download_components(args.components)
+    build_parent_table(args.components, args.output)
+
+
+if __name__ == "__main__":
+    main()
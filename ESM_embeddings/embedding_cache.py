@@ -0,0 +1,110 @@
+#This file contains the content-addressed cache of mean ESM embeddings shared by all FASTA sets.
+#Embeddings are stored in one SQLite file keyed by (sequence hash, model, layer), where the sequence hash is
+#the one in the embedding store index (blake2b of the compact masked sequence). The four-plant set, the
+#all-PDB set and the all-PDB-without-plants set share most of their sequences, and a weekly PDB increment
+#only adds new chains, so only sequences never embedded with the same model and layer go through the model.
+#Each batch is committed as soon as it is embedded, so an interrupted run resumes where it stopped.
+#The cache file can be set with the ESM_EMBEDDING_CACHE environment variable.
+import os
+import sqlite3
+import time
+import numpy as np
+from embedding_store import sequence_hash
+
+CACHE_PATH = os.environ.get('ESM_EMBEDDING_CACHE', 'esm_embedding_cache.sqlite')
+# Hashes per SELECT, below SQLite's limit on bound parameters
+LOOKUP_CHUNK = 500
+
+
+class EmbeddingCache:
+    """Float16 mean embeddings by (sequence hash, model, layer)."""
+
+    def __init__(self, path=CACHE_PATH):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS embeddings (
+                                 sequence_hash TEXT NOT NULL,
+                                 model TEXT NOT NULL,
+                                 layer INTEGER NOT NULL,
+                                 embedding BLOB NOT NULL,
+                                 stored_at REAL NOT NULL,
+                                 PRIMARY KEY (sequence_hash, model, layer))""")
+        self.conn.commit()
+
+    def _select(self, columns, hashes, model, layer):
+        hashes = list(hashes)
+        for start in range(0, len(hashes), LOOKUP_CHUNK):
+            chunk = hashes[start:start + LOOKUP_CHUNK]
+            yield from self.conn.execute(
+                f"SELECT {columns} FROM embeddings WHERE model = ? AND layer = ? "
+                f"AND sequence_hash IN ({','.join('?' * len(chunk))})", [model, layer] + chunk)
+
+    def contains(self, hashes, model, layer):
+        """The subset of hashes that are cached, without reading the embeddings."""
+        return {key for key, in self._select('sequence_hash', hashes, model, layer)}
+
+    def lookup(self, hashes, model, layer):
+        """Cached embeddings of hashes, as a dict hash -> float16 array; misses are left out."""
+        return {key: np.frombuffer(blob, dtype=np.float16)
+                for key, blob in self._select('sequence_hash, embedding', hashes, model, layer)}
+
+    def store(self, hashes, embeddings, model, layer):
+        embeddings = np.asarray(embeddings, dtype=np.float16)
+        now = time.time()
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?, ?)",
+                                  [(key, model, layer, embedding.tobytes(), now)
+                                   for key, embedding in zip(hashes, embeddings)])
+
+    def count(self, model=None, layer=None):
+        if model is None:
+            return self.conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        return self.conn.execute("SELECT COUNT(*) FROM embeddings WHERE model = ? AND layer = ?",
+                                 (model, layer)).fetchone()[0]
+
+    def close(self):
+        self.conn.close()
+
+
+def cached_embed(engine, sequences, cache, batch_rows=10000):
+    """
+    engine.embed(sequences) through the cache: hits are read back, only misses are embedded and added.
+
+    Args:
+        engine (EmbeddingEngine): Engine whose model_key and repr_layer key the cache.
+        sequences (list): Sequences in '<mask>' or compact form.
+        cache (EmbeddingCache): The cache.
+        batch_rows (int): Rows per batch of cached embeddings read back and yielded, which bounds the memory used.
+
+    Returns:
+        iterator: (list of positions in sequences, array of shape (len(positions), embed_dim)) pairs,
+        cached rows first; every position appears once.
+    """
+    model, layer = engine.model_key, engine.repr_layer
+    hashes = [sequence_hash(sequence) for sequence in sequences]
+    cached = cache.contains(set(hashes), model, layer)
+    hits = [i for i, key in enumerate(hashes) if key in cached]
+    # A sequence occurring more than once is embedded once and copied to its other rows
+    first_row = {}
+    duplicates = {}
+    for i, key in enumerate(hashes):
+        if key in cached:
+            continue
+        if key in first_row:
+            duplicates.setdefault(first_row[key], []).append(i)
+        else:
+            first_row[key] = i
+    misses = list(first_row.values())
+    print(f"{len(hits)} of {len(sequences)} sequences found in the embedding cache, {len(misses)} to embed")
+
+    for start in range(0, len(hits), batch_rows):
+        rows = hits[start:start + batch_rows]
+        found = cache.lookup({hashes[i] for i in rows}, model, layer)
+        yield rows, np.stack([found[hashes[i]] for i in rows])
+
+    for batch, means in engine.embed([sequences[i] for i in misses]):
+        rows = [misses[k] for k in batch]
+        cache.store([hashes[i] for i in rows], means, model, layer)
+        extra = [(j, k) for k, i in enumerate(rows) for j in duplicates.get(i, [])]
+        yield rows + [j for j, _ in extra], np.concatenate([means, means[[k for _, k in extra]]])
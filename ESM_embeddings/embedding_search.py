@@ -0,0 +1,213 @@
+#This file contains the nearest-neighbour search over mean ESM embeddings used to compare plant chains with
+#the rest of the PDB. exact_topk is a blocked cosine top-k: the database is read block by block (straight from
+#the memory-mapped embedding store), every block is one float32 matrix multiply against the normalized queries
+#(multithreaded by the BLAS library) and a running top-k per query is kept with argpartition, so no
+#all-pairs matrix is ever held. IVFIndex is an optional approximate index for the 200k+ PDB chains:
+#spherical k-means cells, and each query is compared only with the chains of its nprobe closest cells.
+#Distances are cosine distances, 1 - cosine similarity.
+#Usage: python embedding_search.py plant_store pdb_store neighbours.parquet [-k 10] [--ivf NLIST --nprobe 16]
+import argparse
+import numpy as np
+import pandas as pd
+from embedding_store import EmbeddingStore
+
+BLOCK_ROWS = 65536
+QUERY_BLOCK_ROWS = 4096
+
+
+def normalize_rows(x):
+    """float32 copy of x with unit-length rows (zero rows stay zero)."""
+    x = np.asarray(x, dtype=np.float32)
+    norms = np.linalg.norm(x, axis=1, keepdims=True)
+    return x / np.maximum(norms, np.finfo(np.float32).tiny)
+
+
+def _merge_topk(best_sims, best_rows, sims, rows, k):
+    """Merge candidate similarities (n, m) with row ids rows (n, m) or (m,) into the running top-k (n, k)."""
+    if rows.ndim == 1:
+        rows = np.broadcast_to(rows, sims.shape)
+    sims = np.concatenate([best_sims, sims], axis=1)
+    rows = np.concatenate([best_rows, rows], axis=1)
+    if sims.shape[1] > k:
+        keep = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+        sims = np.take_along_axis(sims, keep, axis=1)
+        rows = np.take_along_axis(rows, keep, axis=1)
+    return sims, rows
+
+
+def _sorted_result(best_sims, best_rows):
+    order = np.argsort(-best_sims, axis=1, kind='stable')
+    sims = np.take_along_axis(best_sims, order, axis=1)
+    rows = np.take_along_axis(best_rows, order, axis=1)
+    return rows, 1.0 - sims
+
+
+def _empty_topk(n, k):
+    return np.full((n, k), -np.inf, dtype=np.float32), np.full((n, k), -1, dtype=np.int64)
+
+
+def exact_topk(queries, database, k=10, block_rows=BLOCK_ROWS, query_block_rows=QUERY_BLOCK_ROWS):
+    """
+    Exact k nearest database rows of every query by cosine distance.
+
+    Args:
+        queries (array): (nq, dim) embeddings, any float dtype.
+        database (array): (n, dim) embeddings; a memory-mapped store matrix is read one block at a time.
+        k (int): Neighbours per query (at most n).
+        block_rows (int): Database rows per block.
+        query_block_rows (int): Queries per matrix multiply.
+
+    Returns:
+        tuple: (rows int64 (nq, k), distances float32 (nq, k)), nearest first.
+    """
+    k = min(k, len(database))
+    queries = normalize_rows(queries)
+    best_sims, best_rows = _empty_topk(len(queries), k)
+    for start in range(0, len(database), block_rows):
+        block = normalize_rows(database[start:start + block_rows])
+        rows = np.arange(start, start + len(block), dtype=np.int64)
+        for q in range(0, len(queries), query_block_rows):
+            part = slice(q, q + query_block_rows)
+            sims = queries[part] @ block.T
+            best_sims[part], best_rows[part] = _merge_topk(best_sims[part], best_rows[part], sims, rows, k)
+    return _sorted_result(best_sims, best_rows)
+
+
+class IVFIndex:
+    """
+    Approximate cosine search with an inverted-file index.
+
+    The database is split into nlist cells by spherical k-means; a query is compared exactly with the rows of
+    its nprobe closest cells. Recall grows with nprobe; nprobe = nlist is an exact search.
+
+    Args:
+        database (array): (n, dim) embeddings (kept as given, e.g. a memory-mapped store matrix).
+        nlist (int): Number of cells; around sqrt(n) is a good start.
+        train_size (int): Rows sampled to train the centroids; nlist is capped at this.
+        iterations (int): k-means iterations.
+        seed (int): Sampling and initialization seed.
+        block_rows (int): Database rows assigned to cells at a time.
+    """
+
+    def __init__(self, database, nlist=512, train_size=100000, iterations=20, seed=0, block_rows=BLOCK_ROWS):
+        self.database = database
+        self.block_rows = block_rows
+        rng = np.random.default_rng(seed)
+        sample = np.sort(rng.choice(len(database), size=min(train_size, len(database)), replace=False))
+        # k-means cannot have more cells than training rows
+        nlist = min(nlist, len(sample))
+        self.centroids = self._train(normalize_rows(database[sample]), nlist, iterations, rng)
+        assignment = np.concatenate([self._nearest_cells(database[start:start + block_rows], 1)[:, 0]
+                                     for start in range(0, len(database), block_rows)])
+        # Rows of cell c, ascending, are self.cell_rows[self.cell_offsets[c]:self.cell_offsets[c + 1]]
+        self.cell_rows = np.argsort(assignment, kind='stable').astype(np.int64)
+        self.cell_offsets = np.zeros(nlist + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignment, minlength=nlist), out=self.cell_offsets[1:])
+
+    @staticmethod
+    def _train(sample, nlist, iterations, rng):
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)]
+        for _ in range(iterations):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            order = np.argsort(assignment, kind='stable')
+            counts = np.bincount(assignment, minlength=nlist)
+            empty = counts == 0
+            sums = np.zeros_like(centroids)
+            sums[~empty] = np.add.reduceat(sample[order], (np.cumsum(counts) - counts)[~empty], axis=0)
+            # An empty cell restarts from a random sample row
+            sums[empty] = sample[rng.choice(len(sample), size=int(empty.sum()), replace=False)]
+            centroids = normalize_rows(sums)
+        return centroids
+
+    def _nearest_cells(self, vectors, nprobe):
+        scores = normalize_rows(vectors) @ self.centroids.T
+        if nprobe >= scores.shape[1]:
+            return np.argsort(-scores, axis=1)
+        return np.argpartition(-scores, nprobe - 1, axis=1)[:, :nprobe]
+
+    def search(self, queries, k=10, nprobe=16):
+        """
+        Approximate k nearest database rows of every query.
+
+        Queries are grouped by probed cell, so each cell is one matrix multiply against all queries probing it.
+
+        Returns:
+            tuple: (rows int64 (nq, k), distances float32 (nq, k)), nearest first. If the probed cells hold
+            fewer than k rows, the missing neighbours have row -1 and distance inf.
+        """
+        queries = normalize_rows(queries)
+        nlist = len(self.centroids)
+        probes = self._nearest_cells(queries, min(nprobe, nlist))
+        best_sims, best_rows = _empty_topk(len(queries), k)
+        query_ids = np.repeat(np.arange(len(queries)), probes.shape[1])
+        cells = probes.ravel()
+        order = np.argsort(cells, kind='stable')
+        query_ids, cells = query_ids[order], cells[order]
+        bounds = np.searchsorted(cells, np.arange(nlist + 1))
+        for cell in np.flatnonzero(np.diff(bounds)):
+            members = query_ids[bounds[cell]:bounds[cell + 1]]
+            rows = self.cell_rows[self.cell_offsets[cell]:self.cell_offsets[cell + 1]]
+            if len(rows) == 0:
+                continue
+            sims = queries[members] @ normalize_rows(self.database[rows]).T
+            best_sims[members], best_rows[members] = _merge_topk(best_sims[members], best_rows[members], sims,
+                                                                 rows, k)
+        return _sorted_result(best_sims, best_rows)
+
+
+def neighbours_table(query_labels, database_labels, rows, distances):
+    """Long table of query_label, rank (1 = nearest), neighbour_label, distance."""
+    k = rows.shape[1]
+    database_labels = np.asarray(database_labels, dtype=object)
+    found = rows.ravel() >= 0
+    table = pd.DataFrame({
+        'query_label': np.repeat(np.asarray(query_labels, dtype=object), k),
+        'rank': np.tile(np.arange(1, k + 1), len(rows)),
+        'neighbour_label': np.where(found, database_labels[np.maximum(rows.ravel(), 0)], None),
+        'distance': distances.ravel(),
+    })
+    return table[found].reset_index(drop=True)
+
+
+def search_stores(query_dir, database_dir, k=10, nlist=None, nprobe=16):
+    """
+    k nearest database chains of every query chain, between two embedding stores.
+
+    Args:
+        query_dir (str): Store of the query chains (e.g. the four-plant set).
+        database_dir (str): Store searched (e.g. the all-PDB set without plants).
+        k (int): Neighbours per query.
+        nlist (int): Use an IVFIndex with this many cells; exact search if None.
+        nprobe (int): Cells probed per query with nlist.
+
+    Returns:
+        pandas.DataFrame: neighbours_table of the result.
+    """
+    queries, database = EmbeddingStore(query_dir), EmbeddingStore(database_dir)
+    if nlist:
+        rows, distances = IVFIndex(database[:], nlist).search(queries[:], k, nprobe)
+    else:
+        rows, distances = exact_topk(queries[:], database[:], k)
+    return neighbours_table(queries.labels, database.labels, rows, distances)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="k nearest database chains of every query chain by cosine distance.")
+    parser.add_argument('query_store')
+    parser.add_argument('database_store')
+    parser.add_argument('output', help=".parquet or .csv")
+    parser.add_argument('-k', type=int, default=10)
+    parser.add_argument('--ivf', type=int, metavar='NLIST', default=None, help="Approximate search with NLIST cells")
+    parser.add_argument('--nprobe', type=int, default=16)
+    args = parser.parse_args()
+
+    table = search_stores(args.query_store, args.database_store, args.k, args.ivf, args.nprobe)
+    if args.output.endswith('.csv'):
+        table.to_csv(args.output, index=False)
+    else:
+        table.to_parquet(args.output, index=False)
+    print(f"Wrote {len(table)} neighbours of {table['query_label'].nunique()} queries to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
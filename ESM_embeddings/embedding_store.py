@@ -0,0 +1,113 @@
+#This file contains the consolidated embedding store that replaces the one-.pt-file-per-sequence output.
+#A store is a directory holding
+#  embeddings.npy  float16 (N, dim) matrix, opened memory-mapped so nothing is read until a row is used
+#  index.parquet   label, sequence_hash (blake2b of the compact masked sequence) and row
+#  meta.json       model, layer, dim, count
+#Row i of the matrix is the i-th record of the FASTA file the store was built from. Files are written under
+#temporary names and renamed at the end, so an interrupted run never leaves a half-written store behind.
+import json
+import os
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from fasta_dedup import sequence_digest
+from residue_masking import from_esm_sequence
+
+EMBEDDINGS_NAME = 'embeddings.npy'
+INDEX_NAME = 'index.parquet'
+META_NAME = 'meta.json'
+INDEX_SCHEMA = pa.schema([
+    pa.field('label', pa.string()),
+    pa.field('sequence_hash', pa.string()),
+    pa.field('row', pa.int64()),
+])
+
+
+def sequence_hash(sequence):
+    """Hex digest of a sequence in compact form, so the '<mask>' and compact forms hash the same."""
+    return sequence_digest(from_esm_sequence(sequence)).hex()
+
+
+def write_store(directory, labels, sequences, batches, dim, model=None, layer=None):
+    """
+    Write a store from per-batch embeddings.
+
+    Args:
+        directory (str): Store directory (created if needed; an existing store is replaced).
+        labels (list): Label of every row.
+        sequences (list): Sequence of every row, for the index hashes.
+        batches (iterable): (row indices, float array of shape (len(indices), dim)) pairs, in any order,
+            e.g. EmbeddingEngine.embed(sequences).
+        dim (int): Embedding size.
+        model (str): Model name, recorded in meta.json.
+        layer (int): Representation layer, recorded in meta.json.
+
+    Returns:
+        int: Number of rows.
+    """
+    os.makedirs(directory, exist_ok=True)
+    count = len(labels)
+    embeddings_path = os.path.join(directory, EMBEDDINGS_NAME)
+    # open_memmap keeps the .npy suffix of the temporary file, so np.load still recognizes it
+    embeddings = np.lib.format.open_memmap(embeddings_path + '.tmp.npy', mode='w+', dtype=np.float16,
+                                           shape=(count, dim))
+    filled = np.zeros(count, dtype=bool)
+    for rows, values in batches:
+        embeddings[rows] = values
+        filled[rows] = True
+    if not filled.all():
+        raise ValueError(f"{int((~filled).sum())} of {count} rows were not embedded")
+    embeddings.flush()
+    del embeddings
+
+    index = pa.table({'label': list(labels),
+                      'sequence_hash': [sequence_hash(sequence) for sequence in sequences],
+                      'row': np.arange(count, dtype=np.int64)}, schema=INDEX_SCHEMA)
+    pq.write_table(index, os.path.join(directory, INDEX_NAME + '.tmp'))
+    with open(os.path.join(directory, META_NAME + '.tmp'), 'w') as f:
+        json.dump({'model': model, 'layer': layer, 'dim': dim, 'count': count, 'dtype': 'float16'}, f)
+
+    os.replace(embeddings_path + '.tmp.npy', embeddings_path)
+    os.replace(os.path.join(directory, INDEX_NAME + '.tmp'), os.path.join(directory, INDEX_NAME))
+    os.replace(os.path.join(directory, META_NAME + '.tmp'), os.path.join(directory, META_NAME))
+    return count
+
+
+class EmbeddingStore:
+    """
+    Read-only view of a store.
+
+    store[i] and store[i:j] are zero-copy views of the memory-mapped matrix; store.get(label) is the row of one
+    label. Selecting many scattered rows (store.rows(labels)) copies them, as any NumPy fancy indexing does.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, META_NAME), 'r') as f:
+            self.meta = json.load(f)
+        self.embeddings = np.load(os.path.join(directory, EMBEDDINGS_NAME), mmap_mode='r')
+        self.index = pq.read_table(os.path.join(directory, INDEX_NAME))
+        self._row_of = None
+
+    def __len__(self):
+        return self.embeddings.shape[0]
+
+    def __getitem__(self, rows):
+        return self.embeddings[rows]
+
+    @property
+    def labels(self):
+        return self.index.column('label').to_pylist()
+
+    def row_of(self, label):
+        if self._row_of is None:
+            self._row_of = dict(zip(self.labels, self.index.column('row').to_pylist()))
+        return self._row_of[label]
+
+    def get(self, label):
+        """Embedding of one label as a (dim,) view."""
+        return self.embeddings[self.row_of(label)]
+
+    def rows(self, labels):
+        """Embeddings of several labels as an (len(labels), dim) array (a copy)."""
+        return self.embeddings[[self.row_of(label) for label in labels]]
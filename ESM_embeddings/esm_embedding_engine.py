@@ -0,0 +1,284 @@
+#This file contains the in-process ESM embedding engine that replaces the extract.py subprocess.
+#The model is loaded once and reused for every FASTA file. Sequences are sorted by token length and packed
+#into batches under a token budget (rows x padded length), so a batch holds sequences of similar length and
+#little compute goes to padding. A background thread tokenizes and pads the next batches while the model runs
+#on the current one. Output files match extract.py --include mean: one <label>.pt per sequence holding
+#{'label': label, 'mean_representations': {layer: tensor}}. embed_fasta_to_store (--store) writes a single
+#float16 memory-mapped matrix with a Parquet index instead (see embedding_store.py).
+#Usage: python esm_embedding_engine.py cleaned_a.fasta [cleaned_b.fasta ...] output_dir [--store] [--threads N]
+import argparse
+import os
+import queue
+import threading
+import numpy as np
+import torch
+import esm
+from embedding_cache import EmbeddingCache, cached_embed
+from embedding_store import write_store
+from fasta_dedup import iter_fasta
+from residue_masking import MASK_CHAR, MASK_TOKEN, from_esm_sequence
+
+MODEL_NAME = 'esm2_t33_650M_UR50D'
+# Token budget per batch. On CPU, large padded batches make the attention tensors outgrow the caches and
+# run slower per token, so the CPU budget is smaller; 4096 is the extract.py default used on GPU.
+TOKS_PER_BATCH = {'cpu': 1024, 'cuda': 4096}
+# Residues per sequence seen by the model, as in extract.py (1024 positions minus BOS and EOS)
+TRUNCATION_SEQ_LENGTH = 1022
+
+
+class EmbeddingEngine:
+    """
+    Mean-pooled per-sequence ESM representations of one layer.
+
+    Args:
+        model: An ESM model (esm.model.esm2.ESM2 or compatible).
+        alphabet (esm.Alphabet): The model's alphabet.
+        repr_layer (int): Layer to pool; the last layer if None (33 for esm2_t33_650M_UR50D).
+        toks_per_batch (int): Token budget per batch, counted as rows x padded length; TOKS_PER_BATCH for
+            the device when None.
+        truncation_seq_length (int): Residues kept per sequence.
+        device (str): 'cpu', 'cuda', ...; cuda if available when None.
+        num_threads (int): torch intra-op threads on CPU; torch's default when None.
+        prefetch (int): Batches tokenized ahead of the model.
+        model_name (str): Recorded with stored embeddings and part of the embedding cache key.
+    """
+
+    def __init__(self, model, alphabet, repr_layer=None, toks_per_batch=None,
+                 truncation_seq_length=TRUNCATION_SEQ_LENGTH, device=None, num_threads=None, prefetch=2,
+                 model_name=None):
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        self.device = torch.device(device or ('cuda' if torch.cuda.is_available() else 'cpu'))
+        self.model = model.eval().to(self.device)
+        self.alphabet = alphabet
+        self.model_name = model_name
+        self.repr_layer = model.num_layers if repr_layer is None else repr_layer
+        self.toks_per_batch = toks_per_batch or TOKS_PER_BATCH.get(self.device.type, TOKS_PER_BATCH['cpu'])
+        self.truncation_seq_length = truncation_seq_length
+        self.prefetch = prefetch
+        self.extra_toks = int(alphabet.prepend_bos) + int(alphabet.append_eos)
+        # Byte -> token id for the single-character tokens; MASK_CHAR stands for '<mask>'
+        self.lut = np.full(256, alphabet.unk_idx, dtype=np.int64)
+        for token, idx in alphabet.tok_to_idx.items():
+            if len(token) == 1 and ord(token) < 256:
+                self.lut[ord(token)] = idx
+        self.lut[ord(MASK_CHAR)] = alphabet.mask_idx
+
+    @property
+    def model_key(self):
+        """Model identity for the embedding cache; includes a non-default truncation, which changes the embeddings."""
+        if self.model_name is None:
+            raise ValueError("The engine has no model_name to key cached embeddings by")
+        if self.truncation_seq_length != TRUNCATION_SEQ_LENGTH:
+            return f'{self.model_name}_trunc{self.truncation_seq_length}'
+        return self.model_name
+
+    @classmethod
+    def from_pretrained(cls, name=MODEL_NAME, **kwargs):
+        """Engine around a pretrained model (a name from esm.pretrained or a path to a .pt checkpoint)."""
+        model, alphabet = esm.pretrained.load_model_and_alphabet(name)
+        return cls(model, alphabet, model_name=os.path.basename(name), **kwargs)
+
+    @classmethod
+    def tiny(cls, num_layers=2, embed_dim=32, attention_heads=4, seed=0, **kwargs):
+        """Engine around a small randomly initialized ESM-2, for testing without the 650M weights."""
+        torch.manual_seed(seed)
+        alphabet = esm.Alphabet.from_architecture("ESM-1b")
+        model = esm.model.esm2.ESM2(num_layers=num_layers, embed_dim=embed_dim, attention_heads=attention_heads,
+                                    alphabet=alphabet)
+        return cls(model, alphabet, model_name=f'tiny_esm2_t{num_layers}_{embed_dim}_seed{seed}', **kwargs)
+
+    def encode(self, sequence):
+        """Token ids of one sequence ('<mask>' or compact form) without BOS/EOS, truncated."""
+        compact = from_esm_sequence(sequence)
+        if '<' in compact:  # Other special tokens; let the alphabet split them
+            ids = np.asarray(self.alphabet.encode(compact.replace(MASK_CHAR, MASK_TOKEN)), dtype=np.int64)
+        else:
+            ids = self.lut[np.frombuffer(compact.encode('latin-1', 'replace'), dtype=np.uint8)]
+        return ids[:self.truncation_seq_length]
+
+    def token_length(self, sequence):
+        """len(self.encode(sequence)) without building the tokens, used to plan the batches."""
+        masks = sequence.count(MASK_TOKEN)
+        if sequence.count('<') > masks:
+            return len(self.encode(sequence))
+        return min(len(sequence) - masks * (len(MASK_TOKEN) - 1), self.truncation_seq_length)
+
+    def plan_batches(self, lengths):
+        """
+        Sequence indices per batch: sorted by length and packed while rows x padded length fits the budget.
+
+        A sequence longer than the budget gets a batch of its own.
+        """
+        order = np.argsort(lengths, kind='stable')
+        batches = []
+        batch = []
+        for i in order.tolist():
+            padded = lengths[i] + self.extra_toks
+            if batch and padded * (len(batch) + 1) > self.toks_per_batch:
+                batches.append(batch)
+                batch = []
+            batch.append(i)
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _tokenize(self, sequences, batch):
+        encoded = [self.encode(sequences[i]) for i in batch]
+        lengths = np.array([len(ids) for ids in encoded], dtype=np.int64)
+        tokens = np.full((len(batch), lengths.max() + self.extra_toks), self.alphabet.padding_idx, dtype=np.int64)
+        start = int(self.alphabet.prepend_bos)
+        if self.alphabet.prepend_bos:
+            tokens[:, 0] = self.alphabet.cls_idx
+        for row, ids in enumerate(encoded):
+            tokens[row, start:start + lengths[row]] = ids
+            if self.alphabet.append_eos:
+                tokens[row, start + lengths[row]] = self.alphabet.eos_idx
+        return torch.from_numpy(tokens), torch.from_numpy(lengths)
+
+    def _tokenized_batches(self, sequences, batches):
+        """Yield (batch, tokens, lengths), tokenizing up to self.prefetch batches ahead in a background thread."""
+        ready = queue.Queue(maxsize=max(1, self.prefetch))
+        stop = threading.Event()
+
+        def producer():
+            try:
+                for batch in batches:
+                    if stop.is_set():
+                        return
+                    ready.put((batch,) + self._tokenize(sequences, batch))
+            except BaseException as e:
+                ready.put(e)
+                return
+            ready.put(None)
+
+        thread = threading.Thread(target=producer, daemon=True)
+        thread.start()
+        try:
+            while True:
+                item = ready.get()
+                if item is None:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+            while thread.is_alive():  # Unblock a producer waiting on a full queue
+                try:
+                    ready.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+
+    def embed(self, sequences):
+        """
+        Yield (indices, means) per batch, in length order.
+
+        Args:
+            sequences (list): Sequences in '<mask>' or compact form.
+
+        Returns:
+            iterator: (list of positions in sequences, float32 array of shape (len(indices), embed_dim)).
+            The mean is over the residue positions, excluding BOS, EOS and padding.
+        """
+        lengths = np.fromiter((self.token_length(sequence) for sequence in sequences), dtype=np.int64,
+                              count=len(sequences))
+        batches = self.plan_batches(lengths)
+        start = int(self.alphabet.prepend_bos)
+        with torch.inference_mode():
+            for batch, tokens, batch_lengths in self._tokenized_batches(sequences, batches):
+                out = self.model(tokens.to(self.device), repr_layers=[self.repr_layer], return_contacts=False)
+                representations = out['representations'][self.repr_layer].float()
+                positions = torch.arange(representations.shape[1], device=self.device)
+                batch_lengths = batch_lengths.to(self.device)
+                residue = (positions[None, :] >= start) & (positions[None, :] < start + batch_lengths[:, None])
+                sums = (representations * residue[:, :, None]).sum(dim=1)
+                means = sums / batch_lengths.clamp(min=1)[:, None]
+                yield batch, means.cpu().numpy()
+
+    def embed_all(self, sequences):
+        """Mean representations of every sequence as an (N, embed_dim) float32 array in input order."""
+        result = np.zeros((len(sequences), self.model.embed_dim), dtype=np.float32)
+        for batch, means in self.embed(sequences):
+            result[batch] = means
+        return result
+
+    def read_fasta(self, fasta_path):
+        """(labels, sequences) of a FASTA file; the label is the header without '>', as in extract.py."""
+        labels, sequences = [], []
+        for header, sequence in iter_fasta(fasta_path):
+            labels.append(header[1:].strip())
+            sequences.append(sequence)
+        return labels, sequences
+
+    def embed_fasta(self, fasta_path, output_dir):
+        """
+        Write one extract.py-style <label>.pt file per record of fasta_path to output_dir.
+
+        Returns:
+            int: Number of sequences embedded.
+        """
+        os.makedirs(output_dir, exist_ok=True)
+        labels, sequences = self.read_fasta(fasta_path)
+        done = 0
+        for batch, means in self.embed(sequences):
+            for i, mean in zip(batch, means):
+                result = {'label': labels[i], 'mean_representations': {self.repr_layer: torch.from_numpy(mean.copy())}}
+                torch.save(result, os.path.join(output_dir, f'{labels[i]}.pt'))
+            done += len(batch)
+            print(f'{fasta_path}: {done} of {len(sequences)} sequences embedded')
+        return len(sequences)
+
+    def embed_fasta_to_store(self, fasta_path, store_dir, cache=None):
+        """
+        Embed every record of fasta_path into an embedding store (row i = record i).
+
+        Args:
+            cache (EmbeddingCache): If given, only sequences missing from it are embedded (and added to it).
+
+        Returns:
+            int: Number of sequences embedded.
+        """
+        labels, sequences = self.read_fasta(fasta_path)
+
+        def batches():
+            done = 0
+            for batch, means in (self.embed(sequences) if cache is None else cached_embed(self, sequences, cache)):
+                done += len(batch)
+                print(f'{fasta_path}: {done} of {len(sequences)} sequences embedded')
+                yield batch, means
+
+        return write_store(store_dir, labels, sequences, batches(), self.model.embed_dim, self.model_name,
+                           self.repr_layer)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mean ESM representations of FASTA files, written as extract.py does.")
+    parser.add_argument('fasta_files', nargs='+')
+    parser.add_argument('output_dir')
+    parser.add_argument('--model', default=MODEL_NAME, help="esm.pretrained name or checkpoint path")
+    parser.add_argument('--repr-layer', type=int, default=None, help="Default: the last layer")
+    parser.add_argument('--toks-per-batch', type=int, default=None, help="Default: 1024 on CPU, 4096 on GPU")
+    parser.add_argument('--truncation-seq-length', type=int, default=TRUNCATION_SEQ_LENGTH)
+    parser.add_argument('--threads', type=int, default=None, help="torch CPU threads")
+    parser.add_argument('--device', default=None)
+    parser.add_argument('--tiny', action='store_true', help="Use a small random model instead of --model (testing)")
+    parser.add_argument('--cache', default=None, help="Embedding cache file (with --store)")
+    parser.add_argument('--store', action='store_true',
+                        help="Write one embedding store per FASTA file, output_dir/<file name without .fasta>")
+    args = parser.parse_args()
+
+    options = dict(repr_layer=args.repr_layer, toks_per_batch=args.toks_per_batch,
+                   truncation_seq_length=args.truncation_seq_length, device=args.device, num_threads=args.threads)
+    engine = EmbeddingEngine.tiny(**options) if args.tiny else EmbeddingEngine.from_pretrained(args.model, **options)
+    cache = EmbeddingCache(args.cache) if args.cache else None
+    for fasta_file in args.fasta_files:
+        if args.store:
+            name = os.path.splitext(os.path.basename(fasta_file))[0]
+            engine.embed_fasta_to_store(fasta_file, os.path.join(args.output_dir, name), cache)
+        else:
+            engine.embed_fasta(fasta_file, args.output_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+#This file contains the streaming FASTA deduplication used on the masked sequence FASTA files.
+#Records are read one at a time and keyed by a 128-bit blake2b digest of the sequence; the first
+#occurrence of each sequence is written immediately, so no full sequence is kept. The in-memory store holds
+#a set of digests (a 16-byte bytes object plus set overhead, roughly 100 bytes per unique sequence), the
+#representative label of every unique sequence when a duplicate map is written, and a count for every
+#distinct label; the SQLite-backed store keeps all of that on disk instead. Duplicate labels are renamed
+#>label_2, >label_3, ... and the labels of dropped records can be written to a duplicate -> representative map.
+#Usage: python fasta_dedup.py in.fasta cleaned_in.fasta [--duplicates map.tsv] [--disk-store seen.sqlite]
+import argparse
+import hashlib
+import os
+import sqlite3
+
+DIGEST_SIZE = 16
+
+
+def iter_fasta(path):
+    """Yield (header, sequence) per record; header is the '>' line stripped, the sequence lines are joined."""
+    header = None
+    lines = []
+    with open(path, 'r') as fasta:
+        for line in fasta:
+            line = line.strip()
+            if line.startswith('>'):
+                if header is not None:
+                    yield header, ''.join(lines)
+                header = line
+                lines = []
+            elif line:
+                lines.append(line)
+    if header is not None:
+        yield header, ''.join(lines)
+
+
+def sequence_digest(sequence):
+    return hashlib.blake2b(sequence.encode(), digest_size=DIGEST_SIZE).digest()
+
+
+class MemoryStore:
+    """
+    Seen digests, representative labels and label counts in dicts and a set.
+
+    Per unique sequence: its digest in a set and, with keep_representatives, a dict entry to its label.
+    Per distinct label: a dict entry holding the label string and its count.
+    """
+
+    def __init__(self, keep_representatives=True):
+        # Without a duplicate map the representative labels are not needed, only the digests
+        self.representatives = {} if keep_representatives else None
+        self.seen = set()
+        self.label_counts = {}
+
+    def add(self, digest, label):
+        """Record digest with its representative label. Returns (True, label) if new, else (False, representative)."""
+        if digest in self.seen:
+            return False, self.representatives[digest] if self.representatives is not None else None
+        self.seen.add(digest)
+        if self.representatives is not None:
+            self.representatives[digest] = label
+        return True, label
+
+    def count_label(self, label):
+        self.label_counts[label] = self.label_counts.get(label, 0) + 1
+        return self.label_counts[label]
+
+    def close(self):
+        pass
+
+
+class SqliteStore:
+    """The same as MemoryStore, kept in an SQLite file so memory stays bounded for any input size."""
+
+    def __init__(self, path):
+        if os.path.exists(path):
+            os.remove(path)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=OFF")
+        self.conn.execute("PRAGMA synchronous=OFF")
+        self.conn.execute("CREATE TABLE seen (digest BLOB PRIMARY KEY, representative TEXT NOT NULL)")
+        self.conn.execute("CREATE TABLE labels (label TEXT PRIMARY KEY, count INTEGER NOT NULL)")
+
+    def add(self, digest, label):
+        if self.conn.execute("INSERT OR IGNORE INTO seen VALUES (?, ?)", (digest, label)).rowcount:
+            return True, label
+        return False, self.conn.execute("SELECT representative FROM seen WHERE digest = ?", (digest,)).fetchone()[0]
+
+    def count_label(self, label):
+        self.conn.execute("INSERT INTO labels VALUES (?, 1) ON CONFLICT(label) DO UPDATE SET count = count + 1",
+                          (label,))
+        return self.conn.execute("SELECT count FROM labels WHERE label = ?", (label,)).fetchone()[0]
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+
+def dedup_fasta(input_file_path, output_file_path, duplicates_path=None, disk_store=None):
+    """
+    Write the first record of every distinct sequence of input_file_path to output_file_path.
+
+    Output matches the former remove_redundancy: records in first-occurrence order, the label is the
+    first word of the header, and a label seen before (in any record) gets a _<count> suffix.
+
+    Args:
+        input_file_path (str): FASTA to deduplicate.
+        output_file_path (str): Output FASTA.
+        duplicates_path (str): Optional TSV of duplicate label -> representative label.
+        disk_store (str): Optional SQLite file for the seen digests and label counts instead of memory.
+
+    Returns:
+        tuple: (records read, records written).
+    """
+    store = SqliteStore(disk_store) if disk_store else MemoryStore(keep_representatives=bool(duplicates_path))
+    duplicates = open(duplicates_path, 'w') if duplicates_path else None
+    read = written = 0
+    try:
+        with open(output_file_path, 'w') as output_file:
+            if duplicates:
+                duplicates.write("duplicate\trepresentative\n")
+            for header, sequence in iter_fasta(input_file_path):
+                # Handle the sequence name for uniqueness
+                label_base = header.split()[0]  # Assuming the unique part of the label is before any spaces
+                count = store.count_label(label_base)
+                label = f"{label_base}_{count}" if count > 1 else label_base
+                if not sequence:
+                    continue
+                read += 1
+                is_new, representative = store.add(sequence_digest(sequence), label)
+                if is_new:
+                    output_file.write(f'{label}\n{sequence}\n')
+                    written += 1
+                elif duplicates:
+                    duplicates.write(f"{label[1:]}\t{representative[1:]}\n")
+    finally:
+        store.close()
+        if duplicates:
+            duplicates.close()
+        if disk_store and os.path.exists(disk_store):
+            os.remove(disk_store)
+    return read, written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Streaming FASTA deduplication by sequence digest.")
+    parser.add_argument('input')
+    parser.add_argument('output')
+    parser.add_argument('--duplicates', help="Write a duplicate -> representative TSV here")
+    parser.add_argument('--disk-store', help="SQLite file for the seen set (bounded memory)")
+    args = parser.parse_args()
+    read, written = dedup_fasta(args.input, args.output, args.duplicates, args.disk_store)
+    print(f"Kept {written} of {read} records")
+
+
+if __name__ == "__main__":
+    main()
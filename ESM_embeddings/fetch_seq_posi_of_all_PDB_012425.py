@@ -6,63 +6,69 @@ import pandas as pd
 import requests
 import subprocess
 import json
+import hashlib
 import numpy as np
-def fetch_protein_pdb_ids(batch_size=1000):
+import pyarrow as pa
+import pyarrow.parquet as pq
+from rcsb_cache import cached_entries, cached_graphql, make_key
+from rcsb_search import PAGE_SIZE, search_ids
+
+# Rows built by process_pdb_id / process_pdb_id_batch
+PDB_SCHEMA = pa.schema([
+    ('pdb_id', pa.string()),
+    ('entity_id', pa.string()),
+    ('sequence', pa.string()),
+    ('instance_id', pa.string()),
+    ('unobserved_residue_xyz', pa.list_(pa.list_(pa.struct([('beg_seq_id', pa.int64()),
+                                                             ('end_seq_id', pa.int64())])))),
+])
+CHECKPOINT_NAME = '_checkpoint.json'
+
+def fetch_protein_pdb_ids(batch_size=PAGE_SIZE):
     """
     Fetch all PDB IDs for entries where Polymer Entity Type is Protein.
 
     Args:
-        batch_size (int): Number of rows to fetch per request.
+        batch_size (int): Number of rows to fetch per request if the search service refuses
+            return_all_hits; the pages are then fetched concurrently.
 
     Returns:
         list: List of PDB IDs.
     """
-    url = "https://search.rcsb.org/rcsbsearch/v2/query"
-    all_pdb_ids = []
-    start = 0
-
-    while True:
-        # Construct the query payload
-        query = {
-            "query": {
-                "type": "terminal",
-                "service": "text",
-                "parameters": {
-                    "attribute": "entity_poly.rcsb_entity_polymer_type",
-                    "operator": "exact_match",
-                    "value": "Protein"
-                }
-            },
-            "return_type": "entry",
-            "request_options": {
-                "paginate": {
-                    "start": start,
-                    "rows": batch_size
-                },
-                "results_content_type": ["experimental"]
-            }
+    query = {
+        "type": "terminal",
+        "service": "text",
+        "parameters": {
+            "attribute": "entity_poly.rcsb_entity_polymer_type",
+            "operator": "exact_match",
+            "value": "Protein"
         }
+    }
+    return search_ids(query, return_type="entry", request_options={"results_content_type": ["experimental"]},
+                      page_size=batch_size)
 
-        # Send the POST request
-        response = requests.post(url, json=query)
-        response.raise_for_status()
-        data = response.json()
-
-        # Extract PDB IDs from the results
-        pdb_ids = [result['identifier'] for result in data.get('result_set', [])]
-        all_pdb_ids.extend(pdb_ids)
 
-        # Break if no more results
-        if len(pdb_ids) < batch_size:
-            break
+def fetch_pdb_data(query, variables=None, retries=3, timeout=10, raise_transient=False):
+    """GraphQL query through the local response cache (see rcsb_cache.py); network only on a miss."""
+    return cached_graphql(query, variables,
+                          lambda query, variables: _post_graphql(query, variables, retries, timeout, raise_transient))
 
-        # Update the start for the next batch
-        start += batch_size
-
-    return all_pdb_ids
+def is_transient(error):
+    """True for failures that say nothing about the request itself: timeouts, dropped connections, 429 and 5xx."""
+    if isinstance(error, (requests.exceptions.Timeout, requests.exceptions.ConnectionError)):
+        return True
+    response = getattr(error, 'response', None)
+    return response is not None and (response.status_code == 429 or response.status_code >= 500)
 
+def _post_graphql(query, variables=None, retries=3, timeout=10, raise_transient=False):
+    """
+    POST a GraphQL query. Transient errors (see is_transient) are retried with exponential backoff;
+    any other error is a bad request, which would fail the same way again, and returns None at once.
 
-def fetch_pdb_data(query, variables=None, retries=3):
+    Raises:
+        requests.exceptions.RequestException: With raise_transient, if the last attempt failed with a
+            transient error (instead of returning None).
+    """
     url = "https://data.rcsb.org/graphql"
     headers = {'Content-Type': 'application/json'}
     payload = {'query': query}
@@ -71,7 +77,7 @@ def fetch_pdb_data(query, variables=None, retries=3):
 
     for attempt in range(retries):
         try:
-            response = requests.post(url, json=payload, headers=headers, timeout=10)
+            response = requests.post(url, json=payload, headers=headers, timeout=timeout)
             response.raise_for_status()
             data = response.json()
             if 'data' in data:
@@ -81,29 +87,54 @@ def fetch_pdb_data(query, variables=None, retries=3):
                 return None
         except requests.exceptions.RequestException as e:
             print(f"Request failed on attempt {attempt + 1} for query: {query} | Error: {e}")
+            if not is_transient(e):
+                return None
             if attempt < retries - 1:
                 time.sleep(2 ** attempt)  # Exponential backoff
+            elif raise_transient:
+                raise
             else:
                 return None
 
-def process_pdb_id(pdb_id):
-    entity_query = f"""
-    {{
-      entry(entry_id: "{pdb_id}") {{
-        polymer_entities {{
-          rcsb_id
-          entity_poly {{
-            pdbx_seq_one_letter_code
-            rcsb_entity_polymer_type
-          }}
-          rcsb_polymer_entity_container_identifiers {{
-            asym_ids
-          }}
-        }}
+ENTITY_QUERY = """
+{{
+  entry(entry_id: "{pdb_id}") {{
+    polymer_entities {{
+      rcsb_id
+      entity_poly {{
+        pdbx_seq_one_letter_code
+        rcsb_entity_polymer_type
+      }}
+      rcsb_polymer_entity_container_identifiers {{
+        asym_ids
       }}
     }}
+  }}
+}}
+"""
+
+FEATURES_QUERY = """
+query getFeatures($instance_ids: [String!]!) {
+  polymer_entity_instances(instance_ids: $instance_ids) {
+    rcsb_id
+    rcsb_polymer_instance_feature {
+      type
+      feature_positions {
+        beg_seq_id
+        end_seq_id
+      }
+    }
+  }
+}
+"""
+
+def entity_rows(pdb_id, entry_data):
+    """
+    Build one row per protein chain instance from the response to ENTITY_QUERY.
+
+    Returns:
+        list: Row dicts with an empty 'unobserved_residue_xyz' list, or [] if the response is invalid.
     """
-    entry_data = fetch_pdb_data(entity_query)
     if entry_data is None:
         print(f"fetch_pdb_data returned None for PDB ID: {pdb_id}")
         return []
@@ -116,7 +147,6 @@ def process_pdb_id(pdb_id):
         print(f"Debug: Raw entry_data -> {entry_data}")
         return []
 
-    instance_ids = []
     data_rows = []
 
     for entity in entry_data['entry']['polymer_entities']:
@@ -124,7 +154,6 @@ def process_pdb_id(pdb_id):
             continue  # Skip non-protein sequences
         for asym_id in entity['rcsb_polymer_entity_container_identifiers']['asym_ids']:
             instance_id = f"{pdb_id}.{asym_id}"
-            instance_ids.append(instance_id)
             data_rows.append({
                 "pdb_id": pdb_id,
                 "entity_id": entity['rcsb_id'],
@@ -132,56 +161,284 @@ def process_pdb_id(pdb_id):
                 "instance_id": instance_id,
                 "unobserved_residue_xyz": []
             })
+    return data_rows
+
+def add_unobserved_features(pdb_id, data_rows, features_data):
+    """Fill 'unobserved_residue_xyz' of data_rows from the response to FEATURES_QUERY."""
+    if features_data and 'polymer_entity_instances' in features_data:
+        rows_by_instance = {row['instance_id']: row for row in data_rows}
+        for instance in features_data['polymer_entity_instances']:
+            if 'rcsb_polymer_instance_feature' in instance and instance['rcsb_polymer_instance_feature'] is not None:
+                unobserved_features = [
+                    feature['feature_positions'] for feature in instance['rcsb_polymer_instance_feature']
+                    if feature['type'] == 'UNOBSERVED_RESIDUE_XYZ'
+                ]
+                if instance['rcsb_id'] in rows_by_instance:
+                    rows_by_instance[instance['rcsb_id']]['unobserved_residue_xyz'].extend(unobserved_features)
+    else:
+        print(f"No feature data available for instances of PDB ID: {pdb_id}")
+
+def entry_record(pdb_id, entry_data, features_data):
+    """
+    The ENTRIES_QUERY record of one entry assembled from the responses to ENTITY_QUERY and FEATURES_QUERY,
+    so that single-entry and batched fetches cache entries in the same shape.
+
+    Returns:
+        dict: The record, or None if the entry is missing or its protein chains have no feature response.
+    """
+    if not entry_data or not isinstance(entry_data.get('entry'), dict):
+        return None
+    has_features = bool(features_data and 'polymer_entity_instances' in features_data)
+    instances = {instance['rcsb_id']: instance
+                 for instance in (features_data or {}).get('polymer_entity_instances') or [] if instance}
+    entities = []
+    for entity in entry_data['entry'].get('polymer_entities') or []:
+        instance_ids = [f"{pdb_id}.{asym_id}"
+                        for asym_id in entity['rcsb_polymer_entity_container_identifiers']['asym_ids']]
+        if instance_ids and entity['entity_poly']['rcsb_entity_polymer_type'] == "Protein" and not has_features:
+            return None
+        entities.append(dict(entity, polymer_entity_instances=[instances[instance_id] for instance_id in instance_ids
+                                                               if instance_id in instances]))
+    return {'rcsb_id': pdb_id.upper(), 'polymer_entities': entities}
 
+def fetch_entry(pdb_id, raise_transient=False):
+    """Record of one entry from ENTITY_QUERY and FEATURES_QUERY (two requests), see entry_record."""
+    entry_data = _post_graphql(ENTITY_QUERY.format(pdb_id=pdb_id), raise_transient=raise_transient)
+    instance_ids = [row['instance_id'] for row in entity_rows(pdb_id, entry_data)]
+    features_data = None
     if instance_ids:
-        features_query = """
-        query getFeatures($instance_ids: [String!]!) {
-          polymer_entity_instances(instance_ids: $instance_ids) {
-            rcsb_id
-            rcsb_polymer_instance_feature {
-              type
-              feature_positions {
-                beg_seq_id
-                end_seq_id
-              }
-            }
+        features_data = _post_graphql(FEATURES_QUERY, variables={"instance_ids": instance_ids},
+                                      raise_transient=raise_transient)
+    return entry_record(pdb_id, entry_data, features_data)
+
+def single_entry_rows(pdb_id, raise_transient=False):
+    """
+    Rows of one entry, from the per-entry cache or two requests (ENTITY_QUERY, then FEATURES_QUERY).
+
+    Returns:
+        dict: {pdb_id: rows} ([] for an entry without protein chains), or {} if there is no data for it.
+    """
+    def fetch(missing):
+        record = fetch_entry(pdb_id, raise_transient)
+        return {} if record is None else {pdb_id: record}
+
+    rows_by_id, missing = batch_entry_rows([pdb_id], cached_entries([pdb_id], ENTRY_FIELDS, fetch))
+    if missing:
+        print(f"No entry data for PDB ID: {pdb_id}")
+    return rows_by_id
+
+def process_pdb_id(pdb_id, raise_transient=False):
+    return single_entry_rows(pdb_id, raise_transient).get(pdb_id, [])
+
+# Batched mode: many entries per request, with the instance features nested in the same query
+ENTRIES_PER_QUERY = 200
+BATCH_TIMEOUT = 60
+# Attempts of a whole batch on timeouts and 5xx (backoff 1, 2, 4, 8 s) before the run gives up on it
+BATCH_RETRIES = 5
+
+ENTRIES_QUERY = """
+query getEntries($entry_ids: [String!]!) {
+  entries(entry_ids: $entry_ids) {
+    rcsb_id
+    polymer_entities {
+      rcsb_id
+      entity_poly {
+        pdbx_seq_one_letter_code
+        rcsb_entity_polymer_type
+      }
+      rcsb_polymer_entity_container_identifiers {
+        asym_ids
+      }
+      polymer_entity_instances {
+        rcsb_id
+        rcsb_polymer_instance_feature {
+          type
+          feature_positions {
+            beg_seq_id
+            end_seq_id
           }
         }
-        """
-        features_data = fetch_pdb_data(features_query, variables={"instance_ids": instance_ids})
-        if features_data and 'polymer_entity_instances' in features_data:
-            for instance in features_data['polymer_entity_instances']:
-                if 'rcsb_polymer_instance_feature' in instance and instance['rcsb_polymer_instance_feature'] is not None:
-                    unobserved_features = [
-                        feature['feature_positions'] for feature in instance['rcsb_polymer_instance_feature']
-                        if feature['type'] == 'UNOBSERVED_RESIDUE_XYZ'
-                    ]
-                    for row in data_rows:
-                        if row['instance_id'] == instance['rcsb_id']:
-                            row['unobserved_residue_xyz'].extend(unobserved_features)
-        else:
-            print(f"No feature data available for instances of PDB ID: {pdb_id}")
+      }
+    }
+  }
+}
+"""
+# Per-entry cache records have the shape of one element of the ENTRIES_QUERY response
+ENTRY_FIELDS = make_key('entry', ENTRIES_QUERY)
 
-    return data_rows
+def entries_by_id(entries_data):
+    """Records of a response to ENTRIES_QUERY ('data', or None if the request failed) by upper-case PDB ID."""
+    entries = {}
+    if entries_data and entries_data.get('entries'):
+        for entry in entries_data['entries']:
+            if entry and entry.get('rcsb_id'):
+                entries[entry['rcsb_id'].upper()] = entry
+    return entries
+
+def fetch_entries(pdb_ids, raise_transient=False):
+    """Records of pdb_ids from the per-entry cache, with one ENTRIES_QUERY request for the entries not cached."""
+    def fetch(missing):
+        return entries_by_id(_post_graphql(ENTRIES_QUERY, {"entry_ids": list(missing)}, retries=BATCH_RETRIES,
+                                           timeout=BATCH_TIMEOUT, raise_transient=raise_transient))
+
+    return cached_entries(pdb_ids, ENTRY_FIELDS, fetch)
+
+def batch_entry_rows(pdb_ids, entries):
+    """
+    Rows per PDB ID from entry records.
+
+    Args:
+        pdb_ids (list): The requested entry IDs.
+        entries (dict): Upper-case PDB ID -> record, as from fetch_entries.
+
+    Returns:
+        tuple: (dict PDB ID -> rows as built by process_pdb_id, list of requested IDs without a record).
+    """
+    rows_by_id = {}
+    missing = []
+    for pdb_id in pdb_ids:
+        entry = entries.get(pdb_id.upper())
+        if entry is None:
+            missing.append(pdb_id)
+            continue
+        data_rows = entity_rows(pdb_id, {'entry': entry})
+        instances = [instance for entity in entry.get('polymer_entities') or []
+                     for instance in entity.get('polymer_entity_instances') or []]
+        if data_rows:
+            add_unobserved_features(pdb_id, data_rows, {'polymer_entity_instances': instances})
+        rows_by_id[pdb_id] = data_rows
+    return rows_by_id, missing
+
+def batch_rows_by_id(pdb_ids):
+    """
+    Rows for many PDB IDs from the per-entry cache and a single ENTRIES_QUERY request for the rest.
+
+    On timeouts, dropped connections and 5xx responses the whole batch is retried with backoff;
+    splitting it would only multiply the requests during an outage. IDs missing from the response
+    (a rejected request, partial data or per-entry errors) are re-requested in two halves, down to
+    single IDs, which go through single_entry_rows.
+
+    Returns:
+        dict: PDB ID -> rows for every entry RCSB returned ([] for an entry without protein chains);
+        IDs without any data are left out.
+
+    Raises:
+        requests.exceptions.RequestException: If the batch still fails with a transient error after
+            BATCH_RETRIES attempts. Nothing is returned for it, so a checkpointed run can resume it.
+    """
+    rows_by_id, missing = batch_entry_rows(pdb_ids, fetch_entries(pdb_ids, raise_transient=True))
+    if len(missing) == 1:
+        rows_by_id.update(single_entry_rows(missing[0], raise_transient=True))
+    elif missing:
+        print(f"Re-requesting {len(missing)} of {len(pdb_ids)} entries in smaller batches")
+        half = len(missing) // 2
+        for part in (missing[:half], missing[half:]):
+            rows_by_id.update(batch_rows_by_id(part))
+    return rows_by_id
+
+def process_pdb_id_batch(pdb_ids):
+    """Rows of all PDB IDs of batch_rows_by_id, in the order of pdb_ids."""
+    rows_by_id = batch_rows_by_id(pdb_ids)
+    return [row for pdb_id in pdb_ids for row in rows_by_id.get(pdb_id, [])]
+
+# Batch processing
+def fetch_batch_rows(batch_ids, entries_per_query=None):
+    """Rows of one batch, either batched (entries_per_query per request) or two requests per entry."""
+    rows = []
+    if entries_per_query:
+        for start in range(0, len(batch_ids), entries_per_query):
+            rows.extend(process_pdb_id_batch(batch_ids[start:start + entries_per_query]))
+    else:
+        for pdb_id in batch_ids:
+            print(pdb_id)
+            data_rows=process_pdb_id(pdb_id)
+            if not data_rows:
+                continue
+            rows.extend(data_rows)
+    return rows
+
+def batch_part_name(i):
+    return f"part-{i:05d}.parquet"
+
+def _ids_digest(pdb_ids):
+    return hashlib.blake2b('\n'.join(pdb_ids).encode(), digest_size=16).hexdigest()
+
+def load_checkpoint(output_dir, pdb_ids, batch_size):
+    """
+    Completed batch indices recorded in output_dir.
+
+    Raises:
+        ValueError: If the checkpoint was written for another ID list or batch size, whose batch
+            indices would not line up with this run.
+    """
+    try:
+        with open(os.path.join(output_dir, CHECKPOINT_NAME), 'r') as json_file:
+            checkpoint = json.load(json_file)
+    except FileNotFoundError:
+        return set()
+    if checkpoint['batch_size'] != batch_size or checkpoint['ids_digest'] != _ids_digest(pdb_ids):
+        raise ValueError(f"{output_dir} was written for a different ID list or batch size; use a new output_dir")
+    # A batch only counts as done if its part file is still there
+    return {i for i in checkpoint['completed'] if os.path.exists(os.path.join(output_dir, batch_part_name(i)))}
+
+def save_checkpoint(output_dir, pdb_ids, batch_size, completed):
+    path = os.path.join(output_dir, CHECKPOINT_NAME)
+    with open(path + '.tmp', 'w') as json_file:
+        json.dump({'batch_size': batch_size, 'n_ids': len(pdb_ids), 'ids_digest': _ids_digest(pdb_ids),
+                   'completed': sorted(completed)}, json_file)
+    os.replace(path + '.tmp', path)
 
 # Batch processing
-def batch_process_pdb_ids(pdb_ids, batch_size=1000):
+def batch_process_pdb_ids(pdb_ids, batch_size=1000, entries_per_query=None, output_dir=None):
+    """
+    Args:
+        pdb_ids (list): Entry IDs.
+        batch_size (int): IDs per progress/throttle batch.
+        entries_per_query (int): If set, fetch this many entries per ENTRIES_QUERY request
+            instead of two requests per entry.
+        output_dir (str): If set, every batch is written to its own part file in output_dir as soon
+            as it is fetched and recorded in a checkpoint; a restarted run skips the finished batches.
+
+    Returns:
+        pandas.DataFrame of all rows, or the output_dir path when streaming to part files.
+    """
     all_data = []
     total_batches = len(pdb_ids) // batch_size + (1 if len(pdb_ids) % batch_size > 0 else 0)
+    completed = set()
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+        completed = load_checkpoint(output_dir, pdb_ids, batch_size)
+        if completed:
+            print(f"Resuming: {len(completed)} of {total_batches} batches already done")
 
     for i in range(total_batches):
+        if i in completed:
+            continue
         batch_ids = pdb_ids[i * batch_size: (i + 1) * batch_size]
         print(f"Processing batch {i + 1} of {total_batches}")
-        for pdb_id in batch_ids:
-            print(pdb_id)
-            data_rows=process_pdb_id(pdb_id)
-            if not data_rows:
-                continue
-            all_data.extend(data_rows)
+        rows = fetch_batch_rows(batch_ids, entries_per_query)
+        if output_dir is None:
+            all_data.extend(rows)
+        else:
+            path = os.path.join(output_dir, batch_part_name(i))
+            pq.write_table(pa.Table.from_pylist(rows, schema=PDB_SCHEMA), path + '.tmp')
+            os.replace(path + '.tmp', path)
+            completed.add(i)
+            save_checkpoint(output_dir, pdb_ids, batch_size, completed)
         time.sleep(1)  # Throttle requests to avoid hitting rate limits
 
+    if output_dir is not None:
+        return output_dir
     return pd.DataFrame(all_data)
 
+def combine_batch_parts(output_dir, output_path):
+    """Concatenate the part files of batch_process_pdb_ids into one Parquet file, one part in memory at a time."""
+    parts = sorted(name for name in os.listdir(output_dir) if name.startswith('part-') and name.endswith('.parquet'))
+    with pq.ParquetWriter(output_path + '.tmp', PDB_SCHEMA) as writer:
+        for name in parts:
+            writer.write_table(pq.read_table(os.path.join(output_dir, name), schema=PDB_SCHEMA))
+    os.replace(output_path + '.tmp', output_path)
+
 def main():
     # Step 1: Fetch PDB IDs
     if not os.path.exists("protein_pdb_ids_012425.json"):
@@ -198,8 +455,10 @@ def main():
     if not pdb_ids:
         print("No valid plant PDB IDs found in the input list.")
     else:
-        pdb_df_012425 = batch_process_pdb_ids(pdb_ids)
-        pdb_df_012425.to_parquet('fetch_API_for_PDB20250124_seq_and_posi.parquet')
+        # Streams one part file per batch; rerunning after a failure resumes from the checkpoint
+        parts_dir = batch_process_pdb_ids(pdb_ids, entries_per_query=ENTRIES_PER_QUERY,
+                                          output_dir='fetch_API_for_PDB20250124_seq_and_posi_parts')
+        combine_batch_parts(parts_dir, 'fetch_API_for_PDB20250124_seq_and_posi.parquet')
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+#This file contains the incremental refresh of the all-PDB sequence/unobserved-residue table.
+#Instead of one monolithic fetch_API_for_PDB20250124_seq_and_posi.parquet, rows live in a Parquet
+#dataset partitioned by the two middle characters of the PDB ID (the wwPDB "divided" layout), and
+#_snapshot.json records the date of the last update. An update asks the search API only for protein
+#entries released or revised since then, fetches just those (batched, see batch_rows_by_id),
+#replaces their rows in the affected partitions and drops entries RCSB has obsoleted. Only entries that
+#were actually fetched (or confirmed removed) are replaced; batches that failed keep their old rows and
+#their IDs are recorded in _snapshot.json and fetched again by the next update.
+#Usage:
+#  python pdb_incremental_update.py --init-from fetch_API_for_PDB20250124_seq_and_posi.parquet --snapshot-date 2025-01-24
+#  python pdb_incremental_update.py            # weekly update
+import argparse
+import datetime
+import json
+import os
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+import requests
+from fetch_seq_posi_of_all_PDB_012425 import ENTRIES_PER_QUERY, PDB_SCHEMA, batch_rows_by_id
+from rcsb_cache import invalidate_entries
+from rcsb_search import PAGE_SIZE, search_ids
+
+DATASET_DIR = 'fetch_API_for_PDB_seq_and_posi'
+# Leading underscore so that pyarrow / pandas dataset discovery skips it
+STATE_NAME = '_snapshot.json'
+REMOVED_URL = "https://data.rcsb.org/rest/v1/holdings/removed/entry_ids"
+
+
+def partition_of(pdb_id):
+    """Partition key: the two characters before the last one (1ABC -> 'ab', also for extended pdb_0000 IDs)."""
+    return pdb_id[-3:-1].lower()
+
+
+def part_path(dataset_dir, partition):
+    return os.path.join(dataset_dir, f"part-{partition}.parquet")
+
+
+def load_state(dataset_dir):
+    try:
+        with open(os.path.join(dataset_dir, STATE_NAME), 'r') as json_file:
+            return json.load(json_file)
+    except FileNotFoundError:
+        return {}
+
+
+def save_state(dataset_dir, state):
+    path = os.path.join(dataset_dir, STATE_NAME)
+    with open(path + '.tmp', 'w') as json_file:
+        json.dump(state, json_file, indent=4)
+    os.replace(path + '.tmp', path)
+
+
+def fetch_updated_protein_ids(since, batch_size=PAGE_SIZE):
+    """
+    PDB IDs of protein entries whose initial release or revision date is on or after since.
+
+    Args:
+        since (str): YYYY-MM-DD.
+        batch_size (int): Rows per page if the search service refuses return_all_hits.
+
+    Returns:
+        list: PDB IDs.
+    """
+    date_nodes = [{"type": "terminal", "service": "text",
+                   "parameters": {"attribute": attribute, "operator": "greater_or_equal", "value": since}}
+                  for attribute in ("rcsb_accession_info.initial_release_date", "rcsb_accession_info.revision_date")]
+    query = {
+        "type": "group",
+        "logical_operator": "and",
+        "nodes": [
+            {"type": "terminal", "service": "text",
+             "parameters": {"attribute": "entity_poly.rcsb_entity_polymer_type", "operator": "exact_match",
+                            "value": "Protein"}},
+            {"type": "group", "logical_operator": "or", "nodes": date_nodes},
+        ]
+    }
+    return search_ids(query, return_type="entry", request_options={"results_content_type": ["experimental"]},
+                      page_size=batch_size)
+
+
+def fetch_removed_ids():
+    """IDs of every entry RCSB has obsoleted or withdrawn."""
+    response = requests.get(REMOVED_URL, timeout=60)
+    response.raise_for_status()
+    return response.json()
+
+
+def fetch_entry_rows(pdb_ids, entries_per_query=ENTRIES_PER_QUERY):
+    """
+    Rows of pdb_ids, batch by batch, keeping track of the entries that could not be fetched.
+
+    Returns:
+        tuple: (rows, set of IDs RCSB returned data for, including entries without protein chains,
+        list of IDs without data: their batch failed with a transient error or RCSB returned nothing).
+    """
+    rows, fetched, failed = [], set(), []
+    for start in range(0, len(pdb_ids), entries_per_query):
+        batch = pdb_ids[start:start + entries_per_query]
+        try:
+            rows_by_id = batch_rows_by_id(batch)
+        except requests.exceptions.RequestException as e:
+            print(f"Batch of {len(batch)} entries failed, left for the next update: {e}")
+            failed.extend(batch)
+            continue
+        for pdb_id in batch:
+            if pdb_id in rows_by_id:
+                fetched.add(pdb_id)
+                rows.extend(rows_by_id[pdb_id])
+            else:
+                failed.append(pdb_id)
+        print(f"Fetched {min(start + entries_per_query, len(pdb_ids))} of {len(pdb_ids)} entries")
+    return rows, fetched, failed
+
+
+def rows_to_table(rows):
+    return pa.Table.from_pylist(rows, schema=PDB_SCHEMA)
+
+
+def dataset_ids(dataset_dir):
+    """Set of PDB IDs currently in the dataset."""
+    if not os.path.isdir(dataset_dir) or not any(name.endswith('.parquet') for name in os.listdir(dataset_dir)):
+        return set()
+    return set(pq.read_table(dataset_dir, columns=['pdb_id'])['pdb_id'].to_pylist())
+
+
+def upsert(dataset_dir, table, drop_ids):
+    """
+    Replace the rows of every PDB ID in drop_ids with the rows of table, partition by partition.
+
+    IDs in drop_ids without rows in table (obsoleted entries, entries no longer containing protein)
+    are just removed. Only partitions touched by table or drop_ids are rewritten, each atomically.
+
+    Returns:
+        int: Number of partitions rewritten.
+    """
+    os.makedirs(dataset_dir, exist_ok=True)
+    partitions = {}
+    for pdb_id in set(drop_ids) | set(table['pdb_id'].to_pylist()):
+        partitions.setdefault(partition_of(pdb_id), set()).add(pdb_id)
+    new_partition = pa.array([partition_of(pdb_id) for pdb_id in table['pdb_id'].to_pylist()], pa.string())
+
+    for partition, pdb_ids in sorted(partitions.items()):
+        path = part_path(dataset_dir, partition)
+        pieces = []
+        if os.path.exists(path):
+            existing = pq.read_table(path, schema=PDB_SCHEMA)
+            pieces.append(existing.filter(pc.invert(pc.is_in(existing['pdb_id'], pa.array(sorted(pdb_ids))))))
+        pieces.append(table.filter(pc.equal(new_partition, partition)))
+        merged = pa.concat_tables(pieces)
+        if merged.num_rows == 0:
+            if os.path.exists(path):
+                os.remove(path)
+            continue
+        merged = merged.sort_by([('pdb_id', 'ascending'), ('instance_id', 'ascending')])
+        pq.write_table(merged, path + '.tmp')
+        os.replace(path + '.tmp', path)
+    return len(partitions)
+
+
+def init_from_parquet(source, dataset_dir=DATASET_DIR, snapshot_date=None):
+    """Split an existing monolithic table (e.g. fetch_API_for_PDB20250124_seq_and_posi.parquet) into the dataset."""
+    table = pq.read_table(source).select(PDB_SCHEMA.names).cast(PDB_SCHEMA)
+    written = upsert(dataset_dir, table, set())
+    save_state(dataset_dir, {'last_update': snapshot_date or datetime.date.today().isoformat(), 'source': source})
+    print(f"Wrote {table.num_rows} rows into {written} partitions of {dataset_dir}")
+
+
+def update(dataset_dir=DATASET_DIR, since=None, entries_per_query=ENTRIES_PER_QUERY):
+    """
+    Fetch the entries released or revised since the last update and merge them into the dataset.
+
+    Entries that could not be fetched keep their current rows and are saved as failed_ids in
+    _snapshot.json; the next update fetches them again together with its own entries.
+
+    Args:
+        dataset_dir (str): Partitioned dataset directory.
+        since (str): YYYY-MM-DD; defaults to the last_update date in _snapshot.json.
+        entries_per_query (int): Entries per batched GraphQL request.
+    """
+    state = load_state(dataset_dir)
+    since = since or state.get('last_update')
+    if since is None:
+        raise ValueError(f"No snapshot date in {dataset_dir}; run with --init-from or pass --since")
+    today = datetime.date.today().isoformat()
+
+    updated_ids = fetch_updated_protein_ids(since)
+    print(f"{len(updated_ids)} protein entries released or revised since {since}")
+    updated = set(updated_ids)
+    retry_ids = [pdb_id for pdb_id in state.get('failed_ids', []) if pdb_id not in updated]
+    if retry_ids:
+        print(f"Retrying {len(retry_ids)} entries that failed in the previous update")
+    removed = set(fetch_removed_ids())
+    to_fetch = [pdb_id for pdb_id in updated_ids + retry_ids if pdb_id not in removed]
+    # Revised entries must not be served from the response cache
+    invalidate_entries(to_fetch)
+    rows, fetched, failed = fetch_entry_rows(to_fetch, entries_per_query)
+
+    removed_ids = removed & dataset_ids(dataset_dir)
+    print(f"{len(removed_ids)} obsoleted entries to remove")
+    # Entries that failed are left untouched, not dropped
+    rewritten = upsert(dataset_dir, rows_to_table(rows), fetched | removed_ids)
+
+    state.update({'last_update': today, 'previous_update': since, 'updated_entries': len(fetched),
+                  'removed_entries': len(removed_ids), 'failed_ids': failed})
+    save_state(dataset_dir, state)
+    if failed:
+        print(f"{len(failed)} entries could not be fetched; they are retried by the next update")
+    print(f"Rewrote {rewritten} partitions; dataset is current as of {today}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Incrementally refresh the partitioned all-PDB sequence dataset.")
+    parser.add_argument('--dataset', default=DATASET_DIR)
+    parser.add_argument('--since', help="YYYY-MM-DD, overrides the date of the last update")
+    parser.add_argument('--init-from', help="Monolithic Parquet file to build the dataset from")
+    parser.add_argument('--snapshot-date', help="YYYY-MM-DD the --init-from file is current as of")
+    args = parser.parse_args()
+
+    if args.init_from:
+        init_from_parquet(args.init_from, args.dataset, args.snapshot_date)
+    else:
+        update(args.dataset, args.since)
+
+
+if __name__ == "__main__":
+    main()
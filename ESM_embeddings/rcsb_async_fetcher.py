@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+#This file contains an asyncio fetcher for the per-entry RCSB GraphQL queries of process_pdb_id.
+#Requests share one pooled aiohttp session, at most `concurrency` are in flight, a token bucket
+#replaces the fixed time.sleep(1) throttle, and every request is retried with exponential backoff
+#on its own. Rows are streamed to a JSON-lines file in input order as entries complete.
+#With --entries-per-query N, N entries and their instance features come from one ENTRIES_QUERY request.
+#Entries go through the same per-entry cache as process_pdb_id (rcsb_cache.py); RCSB_OFFLINE=1 applies too.
+#A chunk that still fails with a transient error after its retries does not stop the run: its IDs are
+#written to <output>.failed.json, a JSON list that can be passed back in with --append.
+#Usage: python rcsb_async_fetcher.py protein_pdb_ids_012425.json fetch_API_for_PDB20250124_seq_and_posi.jsonl
+#  python rcsb_async_fetcher.py fetch_API_for_PDB20250124_seq_and_posi.jsonl.failed.json \
+#      fetch_API_for_PDB20250124_seq_and_posi.jsonl --append        (fetch the failed entries again)
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+import aiohttp
+import rcsb_cache
+from fetch_seq_posi_of_all_PDB_012425 import (BATCH_RETRIES, BATCH_TIMEOUT, ENTITY_QUERY, ENTRIES_QUERY,
+                                              ENTRY_FIELDS, FEATURES_QUERY, batch_entry_rows, entity_rows,
+                                              entries_by_id, entry_record)
+
+GRAPHQL_URL = "https://data.rcsb.org/graphql"
+FAILED_SUFFIX = '.failed.json'
+
+
+class TokenBucket:
+    """Allow `rate` acquisitions per second on average, with bursts of up to `capacity`."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def is_transient(error):
+    """Async counterpart of fetch_seq_posi_of_all_PDB_012425.is_transient."""
+    if isinstance(error, (asyncio.TimeoutError, aiohttp.ClientConnectionError)):
+        return True
+    return isinstance(error, aiohttp.ClientResponseError) and (error.status == 429 or error.status >= 500)
+
+
+async def fetch_pdb_data_async(session, query, variables=None, **post_kwargs):
+    """
+    Async counterpart of fetch_pdb_data: serve the query from the response cache, or POST it with
+    _post_graphql_async.
+
+    Returns:
+        dict: The 'data' member of the response, or None after the last failed attempt.
+    """
+    key = rcsb_cache.make_key('graphql', query, variables)
+    hit, cached = rcsb_cache.lookup(key)
+    if hit:
+        return cached
+    if rcsb_cache.is_offline():
+        raise rcsb_cache.CacheMiss(f"graphql request not in the cache (offline mode): {' '.join(query.split())[:200]}")
+    data = await _post_graphql_async(session, query, variables, **post_kwargs)
+    if data is not None:
+        rcsb_cache.store(key, 'graphql', query, variables, data)
+    return data
+
+
+async def _post_graphql_async(session, query, variables=None, url=GRAPHQL_URL, limiter=None, semaphore=None,
+                              retries=3, timeout=10, raise_transient=False):
+    """
+    POST a GraphQL query with retries and exponential backoff on transient errors (a bad request is not
+    retried).
+
+    Returns:
+        dict: The 'data' member of the response, or None after the last failed attempt.
+
+    Raises:
+        aiohttp.ClientError, asyncio.TimeoutError: With raise_transient, if the last attempt failed
+            with a transient error.
+    """
+    payload = {'query': query}
+    if variables:
+        payload['variables'] = variables
+
+    for attempt in range(retries):
+        try:
+            if limiter is not None:
+                await limiter.acquire()
+            if semaphore is not None:
+                async with semaphore:
+                    data = await _post(session, url, payload, timeout)
+            else:
+                data = await _post(session, url, payload, timeout)
+            if 'data' in data:
+                return data['data']
+            print(f"Unexpected response format: {data}")
+            return None
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"Request failed on attempt {attempt + 1} | Error: {e!r}")
+            if not is_transient(e):
+                return None
+            if attempt < retries - 1:
+                # Exponential backoff with jitter so that failed requests do not retry in lockstep
+                await asyncio.sleep(2 ** attempt + random.random())
+            elif raise_transient:
+                raise
+    return None
+
+
+async def _post(session, url, payload, timeout):
+    async with session.post(url, json=payload, timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+        response.raise_for_status()
+        return await response.json()
+
+
+async def _cached_entries_async(pdb_ids, fetch):
+    """Async counterpart of rcsb_cache.cached_entries for ENTRY_FIELDS records; fetch is a coroutine function."""
+    records = rcsb_cache.lookup_entries(pdb_ids, ENTRY_FIELDS)
+    missing = [pdb_id for pdb_id in pdb_ids if pdb_id.upper() not in records]
+    if not missing:
+        return records
+    if rcsb_cache.is_offline():
+        raise rcsb_cache.CacheMiss(f"{len(missing)} entries not in the cache (offline mode): {' '.join(missing[:20])}")
+    fetched = await fetch(missing)
+    rcsb_cache.store_entries(fetched, ENTRY_FIELDS)
+    records.update(fetched)
+    return records
+
+
+async def process_pdb_id_async(session, pdb_id, **post_kwargs):
+    """Async counterpart of process_pdb_id: the per-entry cache, or the entity query and then the features query."""
+    async def fetch(missing):
+        entry_data = await _post_graphql_async(session, ENTITY_QUERY.format(pdb_id=pdb_id), **post_kwargs)
+        instance_ids = [row['instance_id'] for row in entity_rows(pdb_id, entry_data)]
+        features_data = None
+        if instance_ids:
+            features_data = await _post_graphql_async(session, FEATURES_QUERY, {"instance_ids": instance_ids},
+                                                      **post_kwargs)
+        record = entry_record(pdb_id, entry_data, features_data)
+        return {} if record is None else {pdb_id.upper(): record}
+
+    rows_by_id, missing = batch_entry_rows([pdb_id], await _cached_entries_async([pdb_id], fetch))
+    if missing:
+        print(f"No entry data for PDB ID: {pdb_id}")
+    return rows_by_id.get(pdb_id, [])
+
+
+async def process_pdb_id_batch_async(session, pdb_ids, **post_kwargs):
+    """
+    Async counterpart of process_pdb_id_batch: cached entries are not requested again, transient errors
+    retry the whole batch and only the IDs missing from a response are split.
+    """
+    batch_kwargs = dict(post_kwargs, timeout=max(post_kwargs.get('timeout', 10), BATCH_TIMEOUT),
+                        retries=max(post_kwargs.get('retries', 3), BATCH_RETRIES), raise_transient=True)
+
+    async def fetch(missing):
+        return entries_by_id(await _post_graphql_async(session, ENTRIES_QUERY, {"entry_ids": list(missing)},
+                                                       **batch_kwargs))
+
+    rows_by_id, missing = batch_entry_rows(pdb_ids, await _cached_entries_async(pdb_ids, fetch))
+    if len(missing) == 1:
+        rows_by_id[missing[0]] = await process_pdb_id_async(session, missing[0],
+                                                            **dict(post_kwargs, raise_transient=True))
+    elif missing:
+        print(f"Re-requesting {len(missing)} of {len(pdb_ids)} entries in smaller batches")
+        half = len(missing) // 2
+        # Both halves finish before a failure of either is raised, so no request outlives the caller
+        parts = await asyncio.gather(*(process_pdb_id_batch_async(session, part, **post_kwargs)
+                                       for part in (missing[:half], missing[half:])), return_exceptions=True)
+        for part in parts:
+            if isinstance(part, BaseException):
+                raise part
+        for row in parts[0] + parts[1]:
+            rows_by_id.setdefault(row['pdb_id'], []).append(row)
+    return [row for pdb_id in pdb_ids for row in rows_by_id.get(pdb_id, [])]
+
+
+async def fetch_all(pdb_ids, output_path, url=GRAPHQL_URL, concurrency=32, rate=20.0, retries=3, timeout=10,
+                    entries_per_query=1, append=False):
+    """
+    Fetch every PDB ID concurrently and stream the rows to output_path (JSON lines).
+
+    Rows are written in the order of pdb_ids: finished entries are held back only until every
+    earlier entry has finished, and no chunk more than concurrency * 4 chunks past the first unwritten
+    one is started, so memory holds at most that window.
+
+    A chunk whose request still fails with a transient error (timeout, connection error, 429, 5xx) after
+    its retries writes no rows; its IDs are saved to output_path + FAILED_SUFFIX once the run is over
+    and the other chunks carry on. The file is removed if nothing failed.
+
+    Args:
+        pdb_ids (list): Entry IDs.
+        output_path (str): JSON-lines output, one row per protein chain instance.
+        url (str): GraphQL endpoint; point it at a local stand-in server for testing.
+        concurrency (int): Maximum requests in flight (also the connection pool size).
+        rate (float): Maximum requests per second.
+        retries (int): Attempts per request.
+        timeout (float): Seconds per attempt.
+        entries_per_query (int): Entries per request; above 1 the batched ENTRIES_QUERY is used.
+        append (bool): Append to output_path instead of overwriting it, e.g. when fetching the IDs
+            of an earlier run's failed file.
+
+    Returns:
+        int: Number of rows written.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    limiter = TokenBucket(rate)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    fetch_kwargs = dict(url=url, limiter=limiter, semaphore=semaphore, retries=retries, timeout=timeout)
+    written = 0
+    failed = []
+    async with aiohttp.ClientSession(connector=connector) as session:
+        async def indexed(i, chunk):
+            try:
+                if len(chunk) == 1:
+                    return i, chunk, await process_pdb_id_async(session, chunk[0],
+                                                                **dict(fetch_kwargs, raise_transient=True))
+                return i, chunk, await process_pdb_id_batch_async(session, chunk, **fetch_kwargs)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                print(f"Giving up on {len(chunk)} entries ({chunk[0]}...) for this run: {e!r}")
+                return i, chunk, None
+
+        # Bounded window of chunks past the last written one, so 200k coroutines are not created up front
+        # and a slow entry holds back at most `window` finished chunks (pending and finished together)
+        window = concurrency * 4
+        pending = set()
+        finished = {}
+        next_to_write = 0
+        chunks = enumerate(pdb_ids[start:start + entries_per_query]
+                           for start in range(0, len(pdb_ids), entries_per_query))
+        next_chunk = next(chunks, None)
+        with open(output_path, 'a' if append else 'w') as out:
+            while True:
+                while next_chunk is not None and next_chunk[0] - next_to_write < window:
+                    pending.add(asyncio.ensure_future(indexed(*next_chunk)))
+                    next_chunk = next(chunks, None)
+                if not pending:
+                    break
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    i, chunk, rows = task.result()
+                    if rows is None:
+                        failed.extend(chunk)
+                    finished[i] = rows or []
+                while next_to_write in finished:
+                    for row in finished.pop(next_to_write):
+                        out.write(json.dumps(row) + '\n')
+                        written += 1
+                    next_to_write += 1
+                out.flush()
+
+    failed_path = output_path + FAILED_SUFFIX
+    if failed:
+        with open(failed_path, 'w') as json_file:
+            json.dump(failed, json_file, indent=4)
+        print(f"{len(failed)} entries could not be fetched; their IDs are in {failed_path}")
+    elif os.path.exists(failed_path):
+        os.remove(failed_path)
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent RCSB GraphQL fetch of sequences and unobserved residues.")
+    parser.add_argument('pdb_ids_json', help="JSON list of PDB IDs, e.g. protein_pdb_ids_012425.json")
+    parser.add_argument('output', help="JSON-lines output file")
+    parser.add_argument('--url', default=GRAPHQL_URL)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--rate', type=float, default=20.0, help="Maximum requests per second")
+    parser.add_argument('--retries', type=int, default=3)
+    parser.add_argument('--entries-per-query', type=int, default=1,
+                        help="Entries per batched request, e.g. 200; 1 sends two requests per entry")
+    parser.add_argument('--append', action='store_true',
+                        help=f"Append to the output, e.g. when pdb_ids_json is an earlier run's {FAILED_SUFFIX} file")
+    args = parser.parse_args()
+
+    with open(args.pdb_ids_json, "r") as json_file:
+        pdb_ids = [id for id in json.load(json_file) if id is not None]
+    written = asyncio.run(fetch_all(pdb_ids, args.output, url=args.url, concurrency=args.concurrency,
+                                    rate=args.rate, retries=args.retries,
+                                    entries_per_query=args.entries_per_query, append=args.append))
+    print(f"Wrote {written} rows to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,324 @@
+#This file contains the on-disk response cache shared by the RCSB fetch scripts and the chemcomp lookups.
+#Per-entry data is cached one PDB entry at a time (table entries, keyed by PDB ID and record shape), so a
+#200-entry batch, a single-entry lookup of the plant run and batches with different members all reuse the
+#same rows: a batch only requests the entries that are not cached yet. Other requests are cached whole
+#(table responses), keyed by a blake2b hash of the normalized query text plus its variables; each response
+#also records the PDB IDs it covers. Invalidation by release/revision date drops both.
+#Settings come from the environment (or configure()):
+#  RCSB_CACHE           cache file (default rcsb_response_cache.sqlite, empty string disables the cache)
+#  RCSB_CACHE_TTL_DAYS  entries older than this are refetched (default: never expire)
+#  RCSB_OFFLINE=1       never touch the network; a cache miss raises CacheMiss
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import time
+import requests
+from rcsb_search import PAGE_SIZE, search_ids
+
+CACHE_PATH = 'rcsb_response_cache.sqlite'
+# PDB IDs per SELECT, below SQLite's limit on bound parameters
+LOOKUP_CHUNK = 500
+
+_settings = {
+    'path': os.environ.get('RCSB_CACHE', CACHE_PATH),
+    'ttl_days': float(os.environ['RCSB_CACHE_TTL_DAYS']) if os.environ.get('RCSB_CACHE_TTL_DAYS') else None,
+    'offline': os.environ.get('RCSB_OFFLINE', '') not in ('', '0'),
+}
+_connections = {}
+
+
+class CacheMiss(KeyError):
+    """Raised in offline mode when a response is not in the cache."""
+
+
+def configure(path=None, ttl_days=None, offline=None):
+    """Override the environment settings for this process. Arguments left as None are unchanged."""
+    if path is not None:
+        _settings['path'] = path
+    if ttl_days is not None:
+        _settings['ttl_days'] = ttl_days
+    if offline is not None:
+        _settings['offline'] = offline
+
+
+def is_offline():
+    return _settings['offline']
+
+
+def connect(path=None):
+    """Open (and create if needed) the cache database. One connection per process and path."""
+    path = path or _settings['path']
+    key = (os.getpid(), path)
+    if key not in _connections:
+        conn = sqlite3.connect(path, timeout=60)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""CREATE TABLE IF NOT EXISTS responses (
+                            key TEXT PRIMARY KEY,
+                            kind TEXT NOT NULL,
+                            request TEXT NOT NULL,
+                            response TEXT,
+                            stored_at REAL NOT NULL)""")
+        conn.execute("""CREATE TABLE IF NOT EXISTS response_entries (
+                            key TEXT NOT NULL,
+                            pdb_id TEXT NOT NULL,
+                            PRIMARY KEY (pdb_id, key))""")
+        conn.execute("""CREATE TABLE IF NOT EXISTS entries (
+                            pdb_id TEXT NOT NULL,
+                            fields TEXT NOT NULL,
+                            record TEXT NOT NULL,
+                            stored_at REAL NOT NULL,
+                            PRIMARY KEY (pdb_id, fields))""")
+        conn.commit()
+        _connections[key] = conn
+    return _connections[key]
+
+
+def make_key(kind, text, variables=None):
+    """
+    Content-addressed key of a request.
+
+    Whitespace in text is collapsed and variables are serialized with sorted keys, so the same
+    GraphQL query written with different indentation in two scripts maps to the same entry.
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(kind.encode())
+    digest.update(b'\0' + ' '.join(text.split()).encode())
+    digest.update(b'\0' + json.dumps(variables, sort_keys=True, separators=(',', ':')).encode())
+    return digest.hexdigest()
+
+
+def _entry_ids(text, variables):
+    """PDB IDs a request covers: entry_ids / instance_ids variables or entry_id literals in the query."""
+    variables = variables or {}
+    ids = set(variables.get('entry_ids') or [])
+    ids.update(instance_id.split('.')[0] for instance_id in variables.get('instance_ids') or [])
+    ids.update(re.findall(r'entry_id:\s*"([^"]+)"', text))
+    return {pdb_id.upper() for pdb_id in ids}
+
+
+def _is_expired(stored_at):
+    ttl_days = _settings['ttl_days']
+    return ttl_days is not None and time.time() - stored_at > ttl_days * 86400
+
+
+def lookup(key, path=None):
+    """
+    Cached response for key.
+
+    Returns:
+        tuple: (True, response) on a fresh hit, (False, None) on a miss or an expired entry.
+    """
+    if not (path or _settings['path']):
+        return False, None
+    row = connect(path).execute("SELECT response, stored_at FROM responses WHERE key = ?", (key,)).fetchone()
+    if row is None or _is_expired(row[1]):
+        return False, None
+    return True, json.loads(row[0])
+
+
+def store(key, kind, text, variables, response, path=None):
+    if not (path or _settings['path']):
+        return
+    conn = connect(path)
+    with conn:
+        conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                     (key, kind, json.dumps({'text': text, 'variables': variables}), json.dumps(response),
+                      time.time()))
+        conn.executemany("INSERT OR IGNORE INTO response_entries VALUES (?, ?)",
+                         [(key, pdb_id) for pdb_id in _entry_ids(text, variables)])
+
+
+def cached_call(kind, text, variables, fetch, path=None):
+    """
+    Serve a request from the cache, or call fetch() and cache its result.
+
+    A None result (failed request) is not cached, so it is retried on the next run.
+
+    Raises:
+        CacheMiss: In offline mode, if the request is not cached.
+    """
+    key = make_key(kind, text, variables)
+    hit, response = lookup(key, path)
+    if hit:
+        return response
+    if _settings['offline']:
+        raise CacheMiss(f"{kind} request not in the cache (offline mode): {' '.join(text.split())[:200]}")
+    response = fetch()
+    if response is not None:
+        store(key, kind, text, variables, response, path)
+    return response
+
+
+def lookup_entries(pdb_ids, fields, path=None):
+    """
+    Cached per-entry records.
+
+    Args:
+        pdb_ids (list): PDB IDs (any case).
+        fields (str): Name of the record shape, e.g. make_key('entry', query) of the query that produced it.
+
+    Returns:
+        dict: Upper-case PDB ID -> record, for the fresh hits only.
+    """
+    if not (path or _settings['path']):
+        return {}
+    conn = connect(path)
+    pdb_ids = sorted({pdb_id.upper() for pdb_id in pdb_ids})
+    records = {}
+    for start in range(0, len(pdb_ids), LOOKUP_CHUNK):
+        chunk = pdb_ids[start:start + LOOKUP_CHUNK]
+        for pdb_id, record, stored_at in conn.execute(
+                f"SELECT pdb_id, record, stored_at FROM entries WHERE fields = ? "
+                f"AND pdb_id IN ({','.join('?' * len(chunk))})", [fields] + chunk):
+            if not _is_expired(stored_at):
+                records[pdb_id] = json.loads(record)
+    return records
+
+
+def store_entries(records, fields, path=None):
+    """Cache records, a dict PDB ID -> record of the shape named fields."""
+    if not (path or _settings['path']) or not records:
+        return
+    conn = connect(path)
+    now = time.time()
+    with conn:
+        conn.executemany("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)",
+                         [(pdb_id.upper(), fields, json.dumps(record), now) for pdb_id, record in records.items()])
+
+
+def cached_entries(pdb_ids, fields, fetch, path=None):
+    """
+    Per-entry records of pdb_ids: cached entries are read back and fetch is called once for the rest.
+
+    Args:
+        pdb_ids (list): PDB IDs.
+        fields (str): Name of the record shape (see lookup_entries).
+        fetch (callable): fetch(missing_ids) -> dict PDB ID -> record for the entries it found. Entries it
+            leaves out (unknown IDs, failed requests) are not cached, so they are requested again next time.
+
+    Returns:
+        dict: Upper-case PDB ID -> record.
+
+    Raises:
+        CacheMiss: In offline mode, if an entry is not cached.
+    """
+    records = lookup_entries(pdb_ids, fields, path)
+    missing = [pdb_id for pdb_id in pdb_ids if pdb_id.upper() not in records]
+    if not missing:
+        return records
+    if _settings['offline']:
+        raise CacheMiss(f"{len(missing)} entries not in the cache (offline mode): {' '.join(missing[:20])}")
+    fetched = {pdb_id.upper(): record for pdb_id, record in (fetch(missing) or {}).items()}
+    store_entries(fetched, fields, path)
+    records.update(fetched)
+    return records
+
+
+def cached_graphql(query, variables, fetch, path=None):
+    """cached_call for a GraphQL query; fetch(query, variables) returns the response 'data' or None."""
+    return cached_call('graphql', query, variables, lambda: fetch(query, variables), path)
+
+
+def fetch_chemcomp(code, timeout=5, path=None):
+    """
+    RCSB chemcomp REST record of a chemical component, through the cache.
+
+    Returns:
+        dict: The record, or None if RCSB has no such component (404s are cached as well).
+
+    Raises:
+        requests.exceptions.RequestException: If the request fails for another reason.
+    """
+    def fetch():
+        resp = requests.get(f"https://data.rcsb.org/rest/v1/core/chemcomp/{code}", timeout=timeout)
+        if resp.status_code == 404:
+            return {'not_found': True}
+        resp.raise_for_status()
+        return resp.json()
+
+    record = cached_call('chemcomp', code, None, fetch, path)
+    return None if record.get('not_found') else record
+
+
+def invalidate_entries(pdb_ids, path=None):
+    """
+    Drop the cached records of pdb_ids and every cached response that covers one of them.
+
+    Returns:
+        int: Number of records and responses removed.
+    """
+    conn = connect(path)
+    pdb_ids = [pdb_id.upper() for pdb_id in pdb_ids]
+    with conn:
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS stale (pdb_id TEXT PRIMARY KEY)")
+        conn.execute("DELETE FROM stale")
+        conn.executemany("INSERT OR IGNORE INTO stale VALUES (?)", [(pdb_id,) for pdb_id in pdb_ids])
+        keys = "SELECT key FROM response_entries WHERE pdb_id IN (SELECT pdb_id FROM stale)"
+        removed = conn.execute(f"DELETE FROM responses WHERE key IN ({keys})").rowcount
+        conn.execute(f"DELETE FROM response_entries WHERE key IN ({keys})")
+        removed += conn.execute("DELETE FROM entries WHERE pdb_id IN (SELECT pdb_id FROM stale)").rowcount
+    return removed
+
+
+def invalidate_before(stored_before, kind=None, path=None):
+    """
+    Drop responses stored before the given Unix time (optionally only one kind, e.g. 'chemcomp'; the
+    per-entry records count as kind 'entry').
+    """
+    conn = connect(path)
+    condition = "stored_at < ?" + ("" if kind is None else " AND kind = ?")
+    args = (stored_before,) if kind is None else (stored_before, kind)
+    with conn:
+        removed = conn.execute(f"DELETE FROM responses WHERE {condition}", args).rowcount
+        conn.execute("DELETE FROM response_entries WHERE key NOT IN (SELECT key FROM responses)")
+        if kind in (None, 'entry'):
+            removed += conn.execute("DELETE FROM entries WHERE stored_at < ?", (stored_before,)).rowcount
+    return removed
+
+
+def fetch_ids_released_since(date, attribute='rcsb_accession_info.revision_date', batch_size=PAGE_SIZE):
+    """
+    PDB IDs whose release or revision date is on or after date (YYYY-MM-DD), from the RCSB search API.
+
+    Args:
+        date (str): First day to include.
+        attribute (str): 'rcsb_accession_info.revision_date' or 'rcsb_accession_info.initial_release_date'.
+        batch_size (int): Rows per page if the search service refuses return_all_hits.
+
+    Returns:
+        list: PDB IDs.
+    """
+    query = {"type": "terminal", "service": "text",
+             "parameters": {"attribute": attribute, "operator": "greater_or_equal", "value": date}}
+    return search_ids(query, return_type="entry", page_size=batch_size)
+
+
+def invalidate_released_since(date, attribute='rcsb_accession_info.revision_date', path=None):
+    """
+    Drop the cached records and responses of every entry released or revised on or after date.
+
+    Returns:
+        int: Number of records and responses removed.
+    """
+    return invalidate_entries(fetch_ids_released_since(date, attribute), path)
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Maintain the RCSB response cache.")
+    parser.add_argument('--cache', default=None, help="Cache file (default: RCSB_CACHE or rcsb_response_cache.sqlite)")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--released-since', metavar='YYYY-MM-DD',
+                       help="Drop entries released or revised on or after this date")
+    group.add_argument('--entries', nargs='+', metavar='PDB_ID', help="Drop these entries")
+    group.add_argument('--older-than-days', type=float, help="Drop responses stored more than this many days ago")
+    args = parser.parse_args()
+    if args.released_since:
+        removed = invalidate_released_since(args.released_since, path=args.cache)
+    elif args.entries:
+        removed = invalidate_entries(args.entries, path=args.cache)
+    else:
+        removed = invalidate_before(time.time() - args.older_than_days * 86400, path=args.cache)
+    print(f"Removed {removed} cached records and responses")
@@ -0,0 +1,104 @@
+#This file contains the RCSB search API client used for PDB ID discovery by both fetch scripts.
+#A query first asks for every hit in one response (return_all_hits); if the service refuses that, the
+#first page gives total_count and the remaining pages are requested concurrently. IDs are deduplicated
+#across pages in first-seen order. search_many runs several queries (e.g. one per organism) in parallel.
+from concurrent.futures import ThreadPoolExecutor
+import requests
+
+SEARCH_URL = "https://search.rcsb.org/rcsbsearch/v2/query"
+PAGE_SIZE = 10000
+WORKERS = 8
+# Stable order so that concurrently requested pages neither overlap nor skip hits
+ID_SORT = [{"sort_by": "rcsb_entry_container_identifiers.entry_id", "direction": "asc"}]
+
+
+def _post_search(query, return_type, request_options, timeout):
+    payload = {"query": query, "return_type": return_type, "request_options": request_options}
+    response = requests.post(SEARCH_URL, json=payload, timeout=timeout)
+    if response.status_code == 204:  # No hits
+        return {"total_count": 0, "result_set": []}
+    response.raise_for_status()
+    return response.json()
+
+
+def _unique_ids(pages):
+    seen = set()
+    pdb_ids = []
+    for page in pages:
+        for result in page.get('result_set', []):
+            identifier = result['identifier']
+            if identifier not in seen:
+                seen.add(identifier)
+                pdb_ids.append(identifier)
+    return pdb_ids
+
+
+def search_ids(query, return_type="entry", request_options=None, page_size=PAGE_SIZE, workers=WORKERS,
+               return_all_hits=True, timeout=60):
+    """
+    All identifiers matching a search query.
+
+    Args:
+        query (dict): The "query" node of a search request.
+        return_type (str): e.g. "entry" or "polymer_entity".
+        request_options (dict): Extra request options (results_content_type, sort, scoring_strategy, ...);
+            paginate and return_all_hits are set here.
+        page_size (int): Rows per page when paginating.
+        workers (int): Pages requested at the same time.
+        return_all_hits (bool): Try a single return_all_hits request first.
+        timeout (float): Seconds per request.
+
+    Returns:
+        list: Unique identifiers.
+
+    Raises:
+        requests.exceptions.RequestException: If a page request fails.
+    """
+    request_options = dict(request_options or {})
+    if return_all_hits:
+        try:
+            data = _post_search(query, return_type, dict(request_options, return_all_hits=True), timeout)
+            return _unique_ids([data])
+        except requests.exceptions.HTTPError as e:
+            print(f"return_all_hits refused ({e}); paginating instead")
+
+    if 'sort' not in request_options:
+        request_options['sort'] = ID_SORT
+
+    def page(start):
+        options = dict(request_options, paginate={"start": start, "rows": page_size})
+        return _post_search(query, return_type, options, timeout)
+
+    first = page(0)
+    total_count = first.get('total_count', 0)
+    starts = range(page_size, total_count, page_size)
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        pages = [first] + list(executor.map(page, starts))
+    pdb_ids = _unique_ids(pages)
+    if len(pdb_ids) < total_count:
+        print(f"Warning: {len(pdb_ids)} unique IDs for total_count {total_count}; the index may have changed "
+              f"between pages")
+    return pdb_ids
+
+
+def search_many(queries, workers=WORKERS, **search_kwargs):
+    """
+    Run several searches in parallel.
+
+    Args:
+        queries (dict): name -> query node.
+        workers (int): Searches run at the same time.
+        **search_kwargs: Passed to search_ids.
+
+    Returns:
+        dict: name -> list of identifiers, or the exception raised for that search.
+    """
+    def run(query):
+        try:
+            return search_ids(query, **search_kwargs)
+        except requests.exceptions.RequestException as e:
+            return e
+
+    names = list(queries)
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        return dict(zip(names, executor.map(run, [queries[name] for name in names])))
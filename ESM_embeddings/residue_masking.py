@@ -0,0 +1,177 @@
+#This file contains the unobserved-residue masking engine used before the ESM embedding runs.
+#The unobserved_residue_xyz column is read in whichever form it was stored (list from the fetch
+#scripts, str from a CSV round trip, nested ndarray from Parquet) and flattened into begin/end int32
+#arrays with per-row offsets. All ranges are merged into one interval mask over the concatenated
+#sequences, and each masked sequence is built in a single join. Invalid ranges are reported, not raised.
+#Masked sequences are kept compact, one character per residue with MASK_CHAR for an unobserved one, for
+#deduplication, hashing and storage; the ESM '<mask>' form is produced by to_esm_sequence only when a
+#sequence is handed to ESM.
+import ast
+import numpy as np
+import pandas as pd
+
+MASK_TOKEN = "<mask>"
+# Stands for one masked residue in the compact form; never occurs in PDB one-letter sequences
+MASK_CHAR = "#"
+COMPACT_COLUMN = 'sequence_mask_compact'
+
+
+def parse_unobserved(val):
+    """
+    Unobserved ranges of one row as a list of {'beg_seq_id', 'end_seq_id'} dicts, or NaN if there are none.
+
+    Accepts the list, string (Python literal) and ndarray forms of unobserved_residue_xyz.
+    As before, only the first UNOBSERVED_RESIDUE_XYZ feature of the instance is used.
+    """
+    if isinstance(val, str):
+        if not val.strip():
+            return np.nan
+        try:
+            val = ast.literal_eval(val)  # e.g. [[{'beg_seq_id':..., 'end_seq_id':...}]]
+        except (SyntaxError, ValueError):
+            return np.nan
+    if isinstance(val, np.ndarray):
+        val = val.tolist()
+    if isinstance(val, list) and len(val) > 0:
+        first_element = val[0]
+        if isinstance(first_element, np.ndarray):
+            first_element = first_element.tolist()
+        if isinstance(first_element, list) and len(first_element) > 0:
+            return first_element
+    return np.nan
+
+
+def unobserved_intervals(column):
+    """
+    Flatten a column of unobserved ranges into interval arrays.
+
+    Args:
+        column (iterable): unobserved_residue_xyz values in any storage form.
+
+    Returns:
+        tuple: (begin int32 array, end int32 array, row offsets int64 array of len(column) + 1).
+        Row i's ranges are [offsets[i], offsets[i + 1]), 1-based and inclusive as in the RCSB features.
+    """
+    return _intervals_from_positions([parse_unobserved(val) for val in column])
+
+
+def _intervals_from_positions(rows):
+    begin, end, counts = [], [], []
+    for positions in rows:
+        if not isinstance(positions, list):
+            counts.append(0)
+            continue
+        for position in positions:
+            begin.append(position['beg_seq_id'])
+            end.append(position['end_seq_id'])
+        counts.append(len(positions))
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return np.asarray(begin, dtype=np.int32), np.asarray(end, dtype=np.int32), offsets
+
+
+def _invalid_reason(begin, end, length):
+    if begin < 1:
+        return 'begin < 1'
+    if begin > end:
+        return 'begin > end'
+    return f'end > sequence length {length}'
+
+
+def _merge_intervals(starts, stops):
+    """Sort half-open [start, stop) intervals and merge the overlapping ones."""
+    if len(starts) == 0:
+        return starts, stops
+    order = np.argsort(starts, kind='stable')
+    starts, stops = starts[order], np.maximum.accumulate(stops[order])
+    first = np.flatnonzero(np.concatenate([[True], starts[1:] > stops[:-1]]))
+    last = np.concatenate([first[1:] - 1, [len(starts) - 1]])
+    return starts[first], stops[last]
+
+
+def mask_sequences(sequences, begin, end, offsets, mask_token=MASK_TOKEN):
+    """
+    Mask the unobserved ranges of every sequence.
+
+    All sequences are laid end to end and the valid ranges of every row become sorted, merged
+    half-open intervals over that text (overlapping ranges are fine). The text is cut at interval
+    boundaries and row starts, and each row is one join of its pieces.
+
+    Args:
+        sequences (list): Sequences (already normalized to single letters); non-str values are passed through.
+        begin, end, offsets: Interval arrays from unobserved_intervals.
+        mask_token (str): Token written for each masked residue.
+
+    Returns:
+        tuple: (list of masked sequences, DataFrame of invalid ranges with row, beg_seq_id, end_seq_id,
+        sequence_length, reason). Invalid ranges are skipped; the row's valid ranges are still masked.
+    """
+    is_str = np.fromiter((isinstance(sequence, str) for sequence in sequences), dtype=bool, count=len(sequences))
+    text = ''.join(sequence for sequence in sequences if isinstance(sequence, str))
+    lengths = np.fromiter((len(sequence) if isinstance(sequence, str) else 0 for sequence in sequences),
+                          dtype=np.int64, count=len(sequences))
+    row_start = np.zeros(len(sequences) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=row_start[1:])
+
+    range_row = np.repeat(np.arange(len(sequences)), np.diff(offsets))
+    range_length = lengths[range_row]
+    valid = is_str[range_row] & (begin >= 1) & (begin <= end) & (end <= range_length)
+    # Valid ranges in coordinates of the concatenated text
+    mask_starts, mask_stops = _merge_intervals(row_start[range_row[valid]] + begin[valid] - 1,
+                                               row_start[range_row[valid]] + end[valid])
+
+    # Cut the text at mask boundaries and row starts; a piece is masked if it starts inside a merged range
+    breaks = np.union1d(np.concatenate([mask_starts, mask_stops]), row_start)
+    piece_starts, piece_stops = breaks[:-1], breaks[1:]
+    inside = np.searchsorted(mask_starts, piece_starts, side='right') - 1
+    piece_masked = inside >= 0
+    piece_masked[piece_masked] = piece_starts[piece_masked] < mask_stops[inside[piece_masked]]
+    pieces = [mask_token * (stop - start) if masked else text[start:stop]
+              for start, stop, masked in zip(piece_starts.tolist(), piece_stops.tolist(), piece_masked.tolist())]
+    first_piece = np.searchsorted(breaks, row_start)
+    masked = [''.join(pieces[first_piece[i]:first_piece[i + 1]]) if is_str[i] else sequences[i]
+              for i in range(len(sequences))]
+
+    invalid = [{'row': int(range_row[k]), 'beg_seq_id': int(begin[k]), 'end_seq_id': int(end[k]),
+                'sequence_length': int(range_length[k]),
+                'reason': _invalid_reason(begin[k], end[k], range_length[k])}
+               for k in np.flatnonzero(~valid & is_str[range_row])]
+    invalid = pd.DataFrame(invalid, columns=['row', 'beg_seq_id', 'end_seq_id', 'sequence_length', 'reason'])
+    return masked, invalid
+
+
+def to_esm_sequence(compact):
+    """ESM input form of a compact masked sequence: every MASK_CHAR becomes '<mask>'."""
+    return compact.replace(MASK_CHAR, MASK_TOKEN)
+
+
+def from_esm_sequence(sequence):
+    """Compact form of a '<mask>'-expanded sequence, e.g. from an older sequence_finished_mask column."""
+    return sequence.replace(MASK_TOKEN, MASK_CHAR)
+
+
+def mask_dataframe(df, sequence_col='sequence', column='unobserved_residue_xyz', expand=False):
+    """
+    Add positions_to_be_masked, number_of_positions_to_be_masked and the compact masked sequence
+    (COMPACT_COLUMN) to a copy of df.
+
+    Args:
+        expand (bool): Also add the '<mask>'-expanded sequence_finished_mask column.
+
+    Returns:
+        tuple: (DataFrame, DataFrame of invalid ranges whose 'row' is the index label in df).
+    """
+    if df[sequence_col].str.contains(MASK_CHAR, regex=False).any():
+        raise ValueError(f"'{MASK_CHAR}' occurs in {sequence_col}; the compact form needs another MASK_CHAR")
+    df = df.copy()
+    positions = [parse_unobserved(val) for val in df[column]]
+    df['positions_to_be_masked'] = positions
+    df['number_of_positions_to_be_masked'] = [len(p) if isinstance(p, list) else np.nan for p in positions]
+    begin, end, offsets = _intervals_from_positions(positions)
+    masked, invalid = mask_sequences(df[sequence_col].tolist(), begin, end, offsets, MASK_CHAR)
+    df[COMPACT_COLUMN] = masked
+    if expand:
+        df['sequence_finished_mask'] = [to_esm_sequence(sequence) if isinstance(sequence, str) else sequence
+                                        for sequence in masked]
+    invalid['row'] = df.index[invalid['row'].to_numpy(dtype=np.int64)]
+    return df, invalid
@@ -0,0 +1,100 @@
+#This file contains the exclusion of plant sequences from the PDB set, the step that writes
+#..._exclude_allseq_from2021-20250117_plants.csv. Every normalized sequence is reduced to a fixed-width 16-byte
+#blake2b key. The keys of the plant table form a sorted array, and the PDB table is streamed through it in
+#chunks with one vectorized searchsorted per chunk, so neither full string column is ever in memory and no
+#join on long strings is materialized.
+#A PDB row is excluded when its sequence equals any plant sequence, as with the former merge on 'sequence'
+#(compared after stripping surrounding whitespace and upper-casing).
+#Usage: python sequence_exclusion.py plants.csv pdb.csv pdb_excluded.csv [--report report.json]
+import argparse
+import hashlib
+import json
+import numpy as np
+import pandas as pd
+
+KEY_SIZE = 16
+CHUNKSIZE = 100000
+
+
+def normalize_sequence(sequence):
+    return sequence.strip().upper()
+
+
+def sequence_keys(sequences):
+    """
+    Fixed-width keys of sequences as an 'S16' array. Missing (non-str) sequences get the empty key,
+    which never matches.
+    """
+    return np.array([hashlib.blake2b(normalize_sequence(sequence).encode(), digest_size=KEY_SIZE).digest()
+                     if isinstance(sequence, str) else b'' for sequence in sequences], dtype=f'S{KEY_SIZE}')
+
+
+def build_exclusion_keys(path, column='sequence', chunksize=CHUNKSIZE):
+    """Sorted unique keys of the column of a CSV, read in chunks."""
+    keys = [sequence_keys(chunk[column]) for chunk in pd.read_csv(path, usecols=[column], chunksize=chunksize)]
+    keys = np.unique(np.concatenate(keys)) if keys else np.array([], dtype=f'S{KEY_SIZE}')
+    return keys[keys != b'']
+
+
+def is_excluded(keys, exclusion_keys):
+    """Boolean array: keys found in the sorted exclusion_keys."""
+    if len(exclusion_keys) == 0:
+        return np.zeros(len(keys), dtype=bool)
+    position = np.minimum(np.searchsorted(exclusion_keys, keys), len(exclusion_keys) - 1)
+    return exclusion_keys[position] == keys
+
+
+def exclude_sequences(input_path, exclusion_keys, output_path, column='sequence', chunksize=CHUNKSIZE,
+                      report_path=None):
+    """
+    Stream input_path in chunks and write the rows whose sequence is not in exclusion_keys to output_path.
+
+    Args:
+        input_path (str): CSV to filter (e.g. the unique masked PDB table).
+        exclusion_keys (array): From build_exclusion_keys.
+        output_path (str): Filtered CSV, same columns.
+        column (str): Sequence column.
+        chunksize (int): Rows per chunk.
+        report_path (str): Optional JSON file for the report.
+
+    Returns:
+        dict: Report with rows_read, rows_excluded, rows_written, exclusion_sequences and
+        exclusion_sequences_matched (distinct excluded sequences that occurred in input_path).
+    """
+    rows_read = rows_excluded = 0
+    matched = set()
+    with open(output_path, 'w', newline='') as output:
+        for number, chunk in enumerate(pd.read_csv(input_path, chunksize=chunksize)):
+            keys = sequence_keys(chunk[column])
+            excluded = is_excluded(keys, exclusion_keys)
+            matched.update(keys[excluded].tolist())
+            chunk[~excluded].to_csv(output, header=number == 0, index=False)
+            rows_read += len(chunk)
+            rows_excluded += int(excluded.sum())
+    report = {'input': input_path, 'output': output_path, 'rows_read': rows_read, 'rows_excluded': rows_excluded,
+              'rows_written': rows_read - rows_excluded, 'exclusion_sequences': int(len(exclusion_keys)),
+              'exclusion_sequences_matched': len(matched)}
+    print(f"Excluded {rows_excluded} of {rows_read} rows ({len(matched)} of {len(exclusion_keys)} excluded "
+          f"sequences found); wrote {rows_read - rows_excluded} rows to {output_path}")
+    if report_path:
+        with open(report_path, 'w') as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drop the rows of a table whose sequence occurs in another table.")
+    parser.add_argument('exclude_from', help="CSV whose sequences are excluded (e.g. the plant table)")
+    parser.add_argument('input', help="CSV to filter (e.g. the PDB table)")
+    parser.add_argument('output')
+    parser.add_argument('--column', default='sequence')
+    parser.add_argument('--chunksize', type=int, default=CHUNKSIZE)
+    parser.add_argument('--report', default=None, help="JSON report file")
+    args = parser.parse_args()
+
+    exclusion_keys = build_exclusion_keys(args.exclude_from, args.column, args.chunksize)
+    exclude_sequences(args.input, exclusion_keys, args.output, args.column, args.chunksize, args.report)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,45 +1,23 @@
 #This file contains code for more statistics analysis of pLDDT ditributions.
 #Local file path: /home/lingyuncoding23/AF2_fasta/redo_PDB/extracted_AF2_model_organisms
-import pandas as pd
-import scipy.stats as stats
 import seaborn as sns
 import matplotlib.pyplot as plt
-import scikit_posthocs as sp
-from scipy.signal import find_peaks
-from scipy.stats import gaussian_kde
+from af2_schema import load_af2_table
+from bootstrap_statistics import bootstrap_group_statistics, cliffs_delta_table
+from grouped_statistics import grouped_plddt_statistics
+
+# Typed table written by extract_AF2_48_model_organisms.py: float32 plddt, categorical superkindom
+AF2_merged_shortened_superkindom_again = load_af2_table(
+    columns=['db_accession', 'superkindom', 'plddt', 'AAseq_one_letter_code'])
 
 # Ensure the sequence lengths have been calculated
 AF2_merged_shortened_superkindom_again['sequence_length'] = AF2_merged_shortened_superkindom_again['AAseq_one_letter_code'].str.len()
 
-# Get the unique superkingdom groups
-superkingdom_groups = AF2_merged_shortened_superkindom_again['superkindom'].unique()
-
-# Initialize a dictionary to store results
-results = []
-
-# Loop through each superkingdom and compute correlations
-for group in superkingdom_groups:
-    # Subset data for the current superkingdom
-    group_data = AF2_merged_shortened_superkindom_again[AF2_merged_shortened_superkindom_again['superkindom'] == group]
-    
-    # Compute Pearson correlation
-    pearson_corr, pearson_p = stats.pearsonr(group_data['sequence_length'], group_data['plddt'])
-    
-    # Compute Spearman correlation
-    spearman_corr, spearman_p = stats.spearmanr(group_data['sequence_length'], group_data['plddt'])
-    
-    # Store the results
-    results.append({
-        'superkingdom': group,
-        'pearson_corr': pearson_corr,
-        'pearson_p': pearson_p,
-        'spearman_corr': spearman_corr,
-        'spearman_p': spearman_p
-    })
-
-# Convert the results to a DataFrame for easy viewing
-results_df = pd.DataFrame(results)
+# All per-superkingdom statistics (correlations with length, mean, percentiles, fraction >= 70, KDE peaks)
+# plus Kruskal-Wallis and Dunn's test, from one partition of the table. See grouped_statistics.py.
+summary_df, dunn_test = grouped_plddt_statistics(AF2_merged_shortened_superkindom_again)
 
+results_df = summary_df[['superkingdom', 'pearson_corr', 'pearson_p', 'spearman_corr', 'spearman_p']]
 print(results_df)
 '''    results_df output:
      superkingdom  pearson_corr     pearson_p  spearman_corr    spearman_p
@@ -49,7 +27,8 @@ print(results_df)
 3           Fungi     -0.055514  1.225737e-53      -0.051769  7.213875e-47
 4  Viridiplantae       0.147177  0.000000e+00       0.242971  0.000000e+00
 5         Archaea      0.050844  3.229297e-02       0.142592  1.632023e-09  '''
-mean_plddt_per_superkingdom = AF2_merged_shortened_superkindom_again.groupby('superkindom')['plddt'].mean()
+mean_plddt_per_superkingdom = summary_df.set_index('superkingdom')['mean_plddt']
+print(mean_plddt_per_superkingdom)
 ''' mean_plddt_per_superkingdom output:
 Mean plddt for each superkingdom:
 superkindom
@@ -63,30 +42,26 @@ Name: plddt, dtype: float64  '''
 
 '''The Kruskal-Wallis test is robust for large datasets and non-normal distributions.
 The Dunn’s post-hoc test allows you to explore pairwise differences if the Kruskal-Wallis test is significant.'''
-superkingdom_groups = AF2_merged_shortened_superkindom_again['superkindom'].unique()
-
 # Visualize distributions with boxplots
 plt.figure(figsize=(10, 6))
 sns.boxplot(data=AF2_merged_shortened_superkindom_again, x='superkindom', y='plddt')
 plt.title('Distribution of plddt across Superkingdoms')
 plt.xticks(rotation=45)
 plt.show()
-# Perform Kruskal-Wallis test for non-parametric comparison of distributions
-kruskal_stat, kruskal_p = stats.kruskal(
-    *[AF2_merged_shortened_superkindom_again[AF2_merged_shortened_superkindom_again['superkindom'] == group]['plddt']
-      for group in superkingdom_groups]
-)
+# Kruskal-Wallis test for non-parametric comparison of distributions
+kruskal_p = summary_df['kruskal_p'].iloc[0]
 print(f"Kruskal-Wallis Test: p-value = {kruskal_p}")
-# Perform pairwise comparisons using Dunn's test for post-hoc analysis
-dunn_test = sp.posthoc_dunn(
-    AF2_merged_shortened_superkindom_again, 
-    val_col='plddt', 
-    group_col='superkindom', 
-    p_adjust='bonferroni'
-)
-print("Pairwise post-hoc Dunn's test results (p-values):")
+# Pairwise comparisons using Dunn's test for post-hoc analysis (bonferroni-adjusted), in long form with z scores.
+# At these sample sizes nearly every Dunn p-value underflows to 0.0 (see the earlier output below), so the
+# pairwise differences are also reported as Cliff's delta effect sizes with 95% CIs.
+print("Pairwise post-hoc Dunn's test results (bonferroni-adjusted):")
 print(dunn_test)
-'''Kruskal-Wallis Test: p-value = 0.0
+dunn_test.to_csv('dunn_test_superkingdoms.csv', index=False)
+cliffs_delta_df = cliffs_delta_table(AF2_merged_shortened_superkindom_again)
+print("Pairwise Cliff's delta of plddt (positive: group_a higher):")
+print(cliffs_delta_df)
+'''Earlier output of scikit_posthocs.posthoc_dunn:
+Kruskal-Wallis Test: p-value = 0.0
 Pairwise post-hoc Dunn's test results (p-values):
                     Animalia       Archaea      Bacteria         Fungi  
 Animalia        1.000000e+00  0.000000e+00  0.000000e+00  2.344512e-95   
@@ -104,28 +79,15 @@ Fungi           0.000000e+00    0.000000e+00
 Protist         1.000000e+00    3.339619e-51  
 Viridiplantae   3.339619e-51    1.000000e+00 ''' 
 
-#Perform the same code for all superkingdoms.
-Archaea_df = AF2_merged_shortened_superkindom_again[AF2_merged_shortened_superkindom_again['superkindom'].str.contains('Archaea', case=False)]
-# Plot the KDE and get density values
-kde_plot = sns.kdeplot(data=Archaea_df, x="plddt", hue="superkindom", common_norm=True, common_grid=True)
-density_values = kde_plot.get_lines()[0].get_ydata()
-# Find peaks in the KDE
-peak_indices = find_peaks(density_values)[0]
-x_values = kde_plot.get_lines()[0].get_xdata()
-peak_x_coords = x_values[peak_indices] 
-print("Peak locations in Archaea_df:", peak_x_coords)
-# To find the range where 95% of the data is located
-plddt_values = Archaea_df['plddt'].dropna()
-# Calculate the 2.5th and 97.5th percentiles (for the range covering 95% of the data)
-percentile_2_5 = np.percentile(plddt_values, 2.5)
-percentile_97_5 = np.percentile(plddt_values, 97.5)
-print("Archaea_df 95% of data is located between:", percentile_2_5, "and", percentile_97_5)
-# Filter the dataframe to get rows where plddt >= 70
-plddt_gte_70 = Archaea_df[Archaea_df['plddt'] >= 70]
-# Calculate the percentage of rows with plddt >= 70
-percentage_gte_70 = (len(plddt_gte_70) / len(Archaea_df)) * 100
-print(f"Archaea_df entries number is:{len(Archaea_df)}")
-print(f"Archaea_df Percentage of data with plddt >= 70: {percentage_gte_70:.2f}%")
+# 95% percentile-bootstrap CIs (10,000 resamples) of mean, 2.5/97.5 percentiles, % >= 70 and Spearman vs length
+bootstrap_df = bootstrap_group_statistics(AF2_merged_shortened_superkindom_again, workers=8)
+print(bootstrap_df)
+
+for row in summary_df.itertuples():
+    print(f"Peak locations in {row.superkingdom}_df:", row.peaks)
+    print(f"{row.superkingdom}_df 95% of data is located between:", row.percentile_2_5, "and", row.percentile_97_5)
+    print(f"{row.superkingdom}_df entries number is:{row.n}")
+    print(f"{row.superkingdom}_df Percentage of data with plddt >= 70: {row.percent_gte_70:.2f}%")
 ''' Peak locations in Archaea_df: [38.99735839 53.97425381 69.3351722  94.68068753]
 Archaea_df 95% of data is located between: 62.336 and 97.66
 Archaea_df entries number is:1773
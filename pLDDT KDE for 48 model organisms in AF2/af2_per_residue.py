@@ -0,0 +1,113 @@
+#This file contains the array-backed store for per-residue pLDDT (_ma_qa_metric_local.metric_value).
+#All profiles are concatenated into one memory-mappable values.npy; offsets.npy and accessions.npy
+#index it, so one protein's profile is a slice of the file and the full 200M+ values are never loaded.
+import os
+import numpy as np
+
+VALUES_FILE = 'values.npy'
+OFFSETS_FILE = 'offsets.npy'
+ACCESSIONS_FILE = 'accessions.npy'
+# A profile without an accession is stored with the empty string, the null of a NumPy string array
+MISSING_ACCESSION = ''
+
+# uint8 stores pLDDT rounded to integers (1 byte/residue), float16 keeps ~0.06 precision (2 bytes/residue)
+STORE_DTYPES = ('float16', 'uint8')
+
+
+def to_store_dtype(values, dtype):
+    """Convert one pLDDT profile (strings or floats) to the store dtype."""
+    values = np.asarray(values, dtype=np.float32)
+    if dtype == 'uint8':
+        return np.rint(values).clip(0, 100).astype(np.uint8)
+    return values.astype(np.float16)
+
+
+def write_store(path, accessions, profiles, dtype='float16'):
+    """
+    Write a store from profiles that are already in memory (one tarball's worth).
+
+    Args:
+        path (str): Store directory.
+        accessions (list): UniProt accession of each profile (None if missing).
+        profiles (list): One 1-D array per accession.
+        dtype (str): 'float16' or 'uint8'.
+    """
+    os.makedirs(path, exist_ok=True)
+    lengths = np.fromiter((len(p) for p in profiles), dtype=np.int64, count=len(profiles))
+    offsets = np.zeros(len(profiles) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    values = np.concatenate(profiles).astype(dtype) if profiles else np.zeros(0, dtype=dtype)
+    np.save(os.path.join(path, VALUES_FILE), values)
+    np.save(os.path.join(path, OFFSETS_FILE), offsets)
+    accessions = [MISSING_ACCESSION if accession is None else accession for accession in accessions]
+    np.save(os.path.join(path, ACCESSIONS_FILE), np.asarray(accessions, dtype=str))
+
+
+def combine_stores(part_paths, path):
+    """
+    Concatenate per-tarball stores into one store, copying values through a memory map
+    so the combined array is never held in memory.
+    """
+    parts = [PerResiduePlddtStore(p) for p in part_paths]
+    total = sum(int(part.offsets[-1]) for part in parts)
+    dtype = parts[0].values.dtype if parts else np.float16
+    os.makedirs(path, exist_ok=True)
+    values = np.lib.format.open_memmap(os.path.join(path, VALUES_FILE), mode='w+', dtype=dtype, shape=(total,))
+    offsets = [np.zeros(1, dtype=np.int64)]
+    start = 0
+    for part in parts:
+        end = start + int(part.offsets[-1])
+        values[start:end] = part.values
+        offsets.append(part.offsets[1:] + start)
+        start = end
+    values.flush()
+    del values
+    np.save(os.path.join(path, OFFSETS_FILE), np.concatenate(offsets))
+    accessions = [part.accessions for part in parts]
+    np.save(os.path.join(path, ACCESSIONS_FILE), np.concatenate(accessions) if accessions else np.zeros(0, dtype=str))
+
+
+class PerResiduePlddtStore:
+    """
+    Read-only view of a per-residue pLDDT store.
+
+    Usage:
+        store = PerResiduePlddtStore('AF2_per_residue_plddt')
+        profile = store['P04637']      # memory-mapped slice, no copy
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.values = np.load(os.path.join(path, VALUES_FILE), mmap_mode='r')
+        self.offsets = np.load(os.path.join(path, OFFSETS_FILE))
+        self.accessions = np.load(os.path.join(path, ACCESSIONS_FILE))
+        self._index = None
+
+    def __len__(self):
+        return len(self.accessions)
+
+    def __contains__(self, accession):
+        return accession in self.index
+
+    def __getitem__(self, accession):
+        return self.profile(self.index[accession])
+
+    @property
+    def index(self):
+        """accession -> row, built on first lookup; profiles without an accession are left out."""
+        if self._index is None:
+            self._index = {accession: i for i, accession in enumerate(self.accessions.tolist())
+                           if accession != MISSING_ACCESSION}
+        return self._index
+
+    def accession(self, i):
+        """Accession of row i, None if it was missing."""
+        accession = str(self.accessions[i])
+        return None if accession == MISSING_ACCESSION else accession
+
+    def profile(self, i):
+        """pLDDT profile of row i."""
+        return self.values[self.offsets[i]:self.offsets[i + 1]]
+
+    def lengths(self):
+        return np.diff(self.offsets)
@@ -0,0 +1,100 @@
+#This file contains the typed Arrow schema of the AF2 48 model organism table and its loader.
+#pLDDT and taxonomy IDs are numeric, organism names and superkingdoms are dictionary-encoded and
+#template IDs are a native list column, so the 564k-row table loads without object-dtype columns.
+import os
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Proteome mnemonic (third field of the tarball name, e.g. UP000005640_9606_HUMAN_v4.tar) -> superkingdom,
+# with the group names used in the figures and statistics.
+SUPERKINGDOMS = {
+    'METJA': 'Archaea',
+    'CAMJE': 'Bacteria', 'ECOLI': 'Bacteria', 'ENTFC': 'Bacteria', 'HAEIN': 'Bacteria', 'HELPY': 'Bacteria',
+    'KLEPH': 'Bacteria', 'MYCLE': 'Bacteria', 'MYCTU': 'Bacteria', 'MYCUL': 'Bacteria', '9NOCA1': 'Bacteria',
+    'NEIG1': 'Bacteria', 'PSEAE': 'Bacteria', 'SALTY': 'Bacteria', 'SHIDS': 'Bacteria', 'STAA8': 'Bacteria',
+    'STRR6': 'Bacteria',
+    'AJECG': 'Fungi', 'CANAL': 'Fungi', '9EURO1': 'Fungi', '9EURO2': 'Fungi', 'PARBA': 'Fungi',
+    '9PEZI1': 'Fungi', 'SCHPO': 'Fungi', 'SPOS1': 'Fungi', 'YEAST': 'Fungi',
+    'BRUMA': 'Animalia', 'CAEEL': 'Animalia', 'DANRE': 'Animalia', 'DRAME': 'Animalia', 'DROME': 'Animalia',
+    'HUMAN': 'Animalia', 'MOUSE': 'Animalia', 'ONCVO': 'Animalia', 'RAT': 'Animalia', 'SCHMA': 'Animalia',
+    'STRER': 'Animalia', 'TRITR': 'Animalia', 'WUCBA': 'Animalia',
+    'ARATH': 'Viridiplantae', 'MAIZE': 'Viridiplantae', 'ORYSJ': 'Viridiplantae', 'SOYBN': 'Viridiplantae',
+    'DICDI': 'Protist', 'LEIIN': 'Protist', 'PLAF7': 'Protist', 'TRYB2': 'Protist', 'TRYCC': 'Protist',
+}
+
+AF2_SCHEMA = pa.schema([
+    ('db_accession', pa.string()),
+    ('db_code', pa.string()),
+    ('gene_name', pa.string()),
+    ('ncbi_taxonomy_id', pa.int32()),
+    ('organism_scientific', pa.dictionary(pa.int32(), pa.string())),
+    ('superkindom', pa.dictionary(pa.int32(), pa.string())),
+    ('EMBI_EBI_sequence_checksum', pa.string()),
+    ('pdbx_PDB_id_code', pa.string()),
+    ('plddt', pa.float32()),
+    ('AAseq_one_letter_code', pa.string()),
+    ('template_ids', pa.list_(pa.string())),
+])
+
+# mmCIF placeholders for unknown / not applicable values
+_MISSING = {'?', '.'}
+
+
+def superkingdom_of(tar_file_path):
+    """Superkingdom of a proteome tarball, from the mnemonic in its file name (None if unknown)."""
+    mnemonic = os.path.basename(tar_file_path).split('_')[2]
+    return SUPERKINGDOMS.get(mnemonic)
+
+
+def _value(row, key):
+    value = row.get(key)
+    if value is None or value in _MISSING:
+        return None
+    return value
+
+
+def rows_to_record_batch(rows, superkindom=None):
+    """
+    Convert extracted info dicts (see mmcif_fields.CIF_FIELDS) into one typed record batch.
+
+    Args:
+        rows (list): Info dicts from mmcif_fields.read_cif_gz_fields.
+        superkindom (str): Superkingdom of the tarball the rows come from.
+
+    Returns:
+        pyarrow.RecordBatch: A batch with AF2_SCHEMA.
+    """
+    columns = []
+    for field in AF2_SCHEMA:
+        if field.name == 'superkindom':
+            values = [superkindom] * len(rows)
+        elif field.name == 'template_ids':
+            values = [row.get('template_ids', []) for row in rows]
+        else:
+            values = [_value(row, field.name) for row in rows]
+
+        if pa.types.is_dictionary(field.type):
+            columns.append(pa.array(values, type=pa.string()).dictionary_encode())
+        elif pa.types.is_floating(field.type) or pa.types.is_integer(field.type):
+            # Parsed values are strings; let Arrow do the numeric conversion for the whole column at once
+            columns.append(pa.array(values, type=pa.string()).cast(field.type))
+        else:
+            columns.append(pa.array(values, type=field.type))
+    return pa.RecordBatch.from_arrays(columns, schema=AF2_SCHEMA)
+
+
+def load_af2_table(path='AF2_48_model_oganisms.parquet', columns=None, superkingdoms=None):
+    """
+    Load the AF2 table as a DataFrame with numeric and categorical columns.
+
+    Args:
+        path (str): Combined Parquet file, or one per-tarball part file.
+        columns (list): Columns to read. Defaults to all of them.
+        superkingdoms (list): If given, only rows of these superkingdoms are read.
+
+    Returns:
+        pandas.DataFrame: organism_scientific and superkindom come back as Categorical.
+    """
+    filters = [('superkindom', 'in', list(superkingdoms))] if superkingdoms else None
+    table = pq.read_table(path, columns=columns, filters=filters)
+    return table.to_pandas()
@@ -0,0 +1,151 @@
+#This file contains a random-access index over the AF2 proteome tarballs.
+#The build step records the byte offset and size of every .cif.gz member in an SQLite file, and
+#get_cif(accession) seeks straight to that member instead of re-reading the whole tarball.
+import argparse
+import gzip
+import os
+import sqlite3
+import sys
+import tarfile
+from extract_AF2_48_model_organisms import tar_file_paths
+
+INDEX_PATH = 'AF2_48_model_oganisms_index.sqlite'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS members (
+    db_accession TEXT NOT NULL,
+    fragment INTEGER NOT NULL,
+    tar_path TEXT NOT NULL,
+    member_name TEXT NOT NULL,
+    offset INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    PRIMARY KEY (db_accession, fragment)
+);
+CREATE INDEX IF NOT EXISTS members_tar_path ON members (tar_path);
+CREATE TABLE IF NOT EXISTS tarballs (
+    tar_path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    member_count INTEGER NOT NULL
+);
+"""
+
+
+def parse_member_name(member_name):
+    """
+    Split an AlphaFold member name into accession and fragment number.
+
+    Example: 'AF-Q8WZ42-F12-model_v4.cif.gz' -> ('Q8WZ42', 12)
+    """
+    parts = os.path.basename(member_name).split('-')
+    return parts[1], int(parts[2][1:])
+
+
+def connect(index_path=INDEX_PATH):
+    conn = sqlite3.connect(index_path)
+    conn.executescript(_SCHEMA)
+    return conn
+
+
+def index_tarball(conn, tar_file_path):
+    """
+    (Re)index one tarball. Members are iterated with seeks over the member data, so only the
+    512-byte headers are read.
+
+    Returns:
+        int: Number of .cif.gz members indexed.
+    """
+    tar_path = os.path.abspath(tar_file_path)
+    rows = []
+    with tarfile.open(tar_file_path, 'r:') as tar:
+        for member in tar:
+            if member.isfile() and member.name.endswith('.cif.gz'):
+                accession, fragment = parse_member_name(member.name)
+                rows.append((accession, fragment, tar_path, member.name, member.offset_data, member.size))
+    stat = os.stat(tar_file_path)
+    with conn:
+        conn.execute("DELETE FROM members WHERE tar_path = ?", (tar_path,))
+        conn.executemany("INSERT OR REPLACE INTO members VALUES (?, ?, ?, ?, ?, ?)", rows)
+        conn.execute("INSERT OR REPLACE INTO tarballs VALUES (?, ?, ?, ?)",
+                     (tar_path, stat.st_size, stat.st_mtime, len(rows)))
+    return len(rows)
+
+
+def build_index(tar_paths, index_path=INDEX_PATH):
+    """Index every tarball in tar_paths, skipping the ones whose size and mtime are already recorded."""
+    conn = connect(index_path)
+    try:
+        for tar_file_path in tar_paths:
+            if not os.path.exists(tar_file_path):
+                print(f"Error indexing {tar_file_path}: file not found")
+                continue
+            stat = os.stat(tar_file_path)
+            known = conn.execute("SELECT size, mtime FROM tarballs WHERE tar_path = ?",
+                                 (os.path.abspath(tar_file_path),)).fetchone()
+            if known == (stat.st_size, stat.st_mtime):
+                print(f"{tar_file_path} unchanged, skipping")
+                continue
+            member_count = index_tarball(conn, tar_file_path)
+            print(f"{tar_file_path} indexed ({member_count} members)")
+    finally:
+        conn.close()
+
+
+def get_cif_gz(accession, fragment=1, index_path=INDEX_PATH, conn=None):
+    """
+    Read the compressed .cif.gz member of one accession.
+
+    Raises:
+        KeyError: If the accession is not in the index.
+    """
+    own_conn = conn is None
+    conn = connect(index_path) if own_conn else conn
+    try:
+        row = conn.execute("SELECT tar_path, offset, size FROM members WHERE db_accession = ? AND fragment = ?",
+                           (accession, fragment)).fetchone()
+    finally:
+        if own_conn:
+            conn.close()
+    if row is None:
+        raise KeyError(f"{accession} (F{fragment}) not found in {index_path}")
+    tar_path, offset, size = row
+    with open(tar_path, 'rb') as f:
+        f.seek(offset)
+        return f.read(size)
+
+
+def get_cif(accession, fragment=1, index_path=INDEX_PATH, conn=None):
+    """
+    Return the mmCIF text of one accession, decompressing only its member.
+
+    Args:
+        accession (str): UniProt accession (db_accession), e.g. 'P04637'.
+        fragment (int): AlphaFold fragment number; only >1 for long human proteins.
+        index_path (str): Index built by build_index.
+        conn (sqlite3.Connection): Reuse an open connection for many lookups.
+
+    Returns:
+        str: The mmCIF file content.
+    """
+    return gzip.decompress(get_cif_gz(accession, fragment, index_path, conn)).decode()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Random-access index over the AF2 proteome tarballs.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build_parser = subparsers.add_parser('build', help="Index the tarballs listed in extract_AF2_48_model_organisms.py.")
+    build_parser.add_argument('tar_paths', nargs='*', help="Tarballs to index instead of the default 48.")
+    get_parser = subparsers.add_parser('get', help="Write one accession's mmCIF to stdout.")
+    get_parser.add_argument('accession')
+    get_parser.add_argument('--fragment', type=int, default=1)
+    parser.add_argument('--index', default=INDEX_PATH)
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        build_index(args.tar_paths or tar_file_paths, args.index)
+    else:
+        sys.stdout.write(get_cif(args.accession, args.fragment, args.index))
+
+
+if __name__ == "__main__":
+    main()
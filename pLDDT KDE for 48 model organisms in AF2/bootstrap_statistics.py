@@ -0,0 +1,172 @@
+#This file contains bootstrap confidence intervals and effect sizes for the superkingdom pLDDT statistics.
+#At 564k rows every Dunn p-value underflows to 0.0, so the analysis reports uncertainty instead:
+#percentile-bootstrap CIs of the per-group statistics and Cliff's delta (with CIs) for every group pair.
+#Resamples are drawn as batched index matrices, values are ranked once per group and those ranks are
+#reused for every resample's Spearman correlation, and chunks of resamples run on a process pool.
+from itertools import combinations
+from multiprocessing import Pool
+import numpy as np
+import pandas as pd
+import scipy.stats as stats
+from grouped_statistics import PLDDT_THRESHOLD, partition
+
+N_RESAMPLES = 10000
+CONFIDENCE = 0.95
+# Memory budget of one resample chunk. Per element of the (resamples x group size) matrix a chunk holds the
+# int32 index (4 bytes) plus either the float32 resampled values (4 bytes; the percentiles partition them in
+# place) or the two float32 gathered rank rows (8 bytes), so the peak is CHUNK_BYTES per running task
+BYTES_PER_ELEMENT = 12
+CHUNK_BYTES = 256 << 20
+
+
+def bootstrap_statistic_names(threshold=PLDDT_THRESHOLD):
+    """Names of the bootstrapped statistics; the percentage is named as in grouped_plddt_statistics."""
+    return ['mean_plddt', 'percentile_2_5', 'percentile_97_5', f'percent_gte_{threshold:g}', 'spearman_corr']
+
+
+BOOTSTRAP_STATISTICS = bootstrap_statistic_names()
+
+
+def _row_correlation(x, y):
+    """Pearson correlation of every row of x with the same row of y. x and y are centered in place."""
+    x -= x.mean(axis=1, keepdims=True, dtype=np.float64).astype(x.dtype)
+    y -= y.mean(axis=1, keepdims=True, dtype=np.float64).astype(y.dtype)
+    xy = np.einsum('ij,ij->i', x, y, dtype=np.float64)
+    return xy / np.sqrt(np.einsum('ij,ij->i', x, x, dtype=np.float64) * np.einsum('ij,ij->i', y, y, dtype=np.float64))
+
+
+def _bootstrap_chunk(task):
+    """
+    Statistics of n_resamples bootstrap resamples of one group.
+
+    Spearman is the Pearson correlation of the ranks computed once on the full group and gathered
+    through the resample indices, which avoids re-ranking every resample (ties created by drawing
+    the same row twice are not re-averaged; the effect on the CI is negligible at these sizes).
+    """
+    values, value_ranks, length_ranks, n_resamples, seed, threshold = task
+    rng = np.random.default_rng(seed)
+    n = len(values)
+    indices = rng.integers(0, n, size=(n_resamples, n), dtype=np.int32 if n < 2 ** 31 else np.int64)
+    resampled = values[indices]
+    result = np.empty((n_resamples, len(BOOTSTRAP_STATISTICS)))
+    result[:, 0] = resampled.mean(axis=1, dtype=np.float64)
+    result[:, 3] = 100.0 * (resampled >= threshold).sum(axis=1) / n
+    result[:, 1:3] = np.percentile(resampled, [2.5, 97.5], axis=1, overwrite_input=True).T
+    del resampled
+    if length_ranks is None:
+        result[:, 4] = np.nan
+    else:
+        result[:, 4] = _row_correlation(value_ranks[indices], length_ranks[indices])
+    return result
+
+
+def _tasks(values, value_ranks, length_ranks, n_resamples, seed_sequence, threshold, chunk_bytes):
+    # float32 halves the gathered matrices; pLDDT has two decimals and ranks are exact half-integers up to 2^23
+    values = values.astype(np.float32)
+    value_ranks = value_ranks.astype(np.float32)
+    if length_ranks is not None:
+        length_ranks = length_ranks.astype(np.float32)
+    chunk = max(1, min(n_resamples, chunk_bytes // (BYTES_PER_ELEMENT * len(values))))
+    starts = range(0, n_resamples, chunk)
+    seeds = seed_sequence.spawn(len(starts))
+    return [(values, value_ranks, length_ranks, min(chunk, n_resamples - start), seed, threshold)
+            for start, seed in zip(starts, seeds)]
+
+
+def bootstrap_group_statistics(df, value_col='plddt', length_col='sequence_length', group_col='superkindom',
+                               n_resamples=N_RESAMPLES, confidence=CONFIDENCE, workers=1, seed=0,
+                               threshold=PLDDT_THRESHOLD, chunk_bytes=CHUNK_BYTES):
+    """
+    Percentile-bootstrap confidence intervals of the per-group pLDDT statistics.
+
+    Args:
+        df (pandas.DataFrame): Row-level table, e.g. from af2_schema.load_af2_table.
+        value_col (str): pLDDT column.
+        length_col (str): Sequence length column for the Spearman correlation (None to skip it).
+        group_col (str): Grouping column.
+        n_resamples (int): Bootstrap resamples per group.
+        confidence (float): Confidence level of the intervals.
+        workers (int): Processes for the resample chunks. 1 runs in this process.
+        seed (int): Seed of the resampling; results are reproducible for a given seed and chunk_bytes.
+        threshold (float): Cut-off for the percentage statistic, named percent_gte_<threshold>.
+        chunk_bytes (int): Memory budget of one resample chunk; the peak memory is about workers * chunk_bytes.
+
+    Returns:
+        pandas.DataFrame: Tidy table with superkingdom, statistic, estimate, ci_low, ci_high.
+    """
+    columns = [value_col] if length_col is None else [value_col, length_col]
+    labels, boundaries, arrays = partition(df.dropna(subset=columns), group_col, columns)
+    seed_sequences = np.random.SeedSequence(seed).spawn(len(labels))
+
+    tasks, owners = [], []
+    estimates = {}
+    for i, group in enumerate(labels):
+        values = arrays[value_col][boundaries[i]:boundaries[i + 1]]
+        value_ranks = stats.rankdata(values)
+        length_ranks = None
+        if length_col is not None:
+            length_ranks = stats.rankdata(arrays[length_col][boundaries[i]:boundaries[i + 1]])
+        estimates[group] = [values.mean(), *np.percentile(values, [2.5, 97.5]),
+                            100.0 * np.count_nonzero(values >= threshold) / len(values),
+                            np.nan if length_ranks is None else np.corrcoef(value_ranks, length_ranks)[0, 1]]
+        group_tasks = _tasks(values, value_ranks, length_ranks, n_resamples, seed_sequences[i], threshold,
+                             chunk_bytes)
+        tasks.extend(group_tasks)
+        owners.extend([group] * len(group_tasks))
+
+    if workers <= 1:
+        chunks = list(map(_bootstrap_chunk, tasks))
+    else:
+        with Pool(workers) as pool:
+            chunks = pool.map(_bootstrap_chunk, tasks)
+
+    alpha = (1 - confidence) / 2
+    rows = []
+    for group in labels:
+        resamples = np.vstack([chunk for chunk, owner in zip(chunks, owners) if owner == group])
+        low, high = np.nanpercentile(resamples, [100 * alpha, 100 * (1 - alpha)], axis=0)
+        for k, statistic in enumerate(bootstrap_statistic_names(threshold)):
+            rows.append({'superkingdom': group, 'statistic': statistic, 'estimate': estimates[group][k],
+                         'ci_low': low[k], 'ci_high': high[k]})
+    return pd.DataFrame(rows)
+
+
+def cliffs_delta(a, b):
+    """
+    Cliff's delta P(a > b) - P(a < b) with a DeLong-type confidence interval.
+
+    Both the estimate and the placement variances come from sorted searches, O((n_a + n_b) log n_b),
+    instead of the n_a x n_b comparison matrix.
+
+    Returns:
+        tuple: (delta, standard error).
+    """
+    a = np.sort(a)
+    b = np.sort(b)
+    less = np.searchsorted(b, a, side='left')
+    greater = len(b) - np.searchsorted(b, a, side='right')
+    # Placements: for each a, (fraction of b below - fraction of b above); for each b, the same seen from a
+    placements_a = (less - greater) / len(b)
+    placements_b = ((len(a) - np.searchsorted(a, b, side='right')) - np.searchsorted(a, b, side='left')) / len(a)
+    delta = placements_a.mean()
+    variance = placements_a.var(ddof=1) / len(a) + placements_b.var(ddof=1) / len(b)
+    return delta, np.sqrt(variance)
+
+
+def cliffs_delta_table(df, value_col='plddt', group_col='superkindom', confidence=CONFIDENCE):
+    """
+    Cliff's delta of value_col for every pair of groups, with normal-approximation CIs.
+
+    Returns:
+        pandas.DataFrame: group_a, group_b, cliffs_delta, ci_low, ci_high. A positive delta means
+        group_a tends to have higher values than group_b.
+    """
+    labels, boundaries, arrays = partition(df.dropna(subset=[value_col]), group_col, [value_col])
+    values = arrays[value_col]
+    z = stats.norm.ppf(1 - (1 - confidence) / 2)
+    rows = []
+    for i, j in combinations(range(len(labels)), 2):
+        delta, se = cliffs_delta(values[boundaries[i]:boundaries[i + 1]], values[boundaries[j]:boundaries[j + 1]])
+        rows.append({'group_a': labels[i], 'group_b': labels[j], 'cliffs_delta': delta,
+                     'ci_low': max(-1.0, delta - z * se), 'ci_high': min(1.0, delta + z * se)})
+    return pd.DataFrame(rows)
@@ -0,0 +1,188 @@
+#This file contains the figure-build entry point for the superkingdom pLDDT box plot and KDE plot.
+#Box statistics (quartiles, 5/95 whiskers, a capped random subset of the outliers) and KDE curves are
+#computed once from the row-level table and saved as small summaries; the figures are then drawn from
+#the summaries with the styling of Bar_superkingdoms.py / KDE_superkingdoms.py, so regenerating every
+#panel does not touch the 564k rows or draw tens of thousands of flier markers. The summaries are rebuilt
+#whenever the table is newer than them, so a data refresh is never drawn from stale statistics.
+#Usage: python build_figures.py --formats png svg
+import argparse
+import colorsys
+import json
+import os
+import numpy as np
+import matplotlib
+import matplotlib.pyplot as plt
+import seaborn as sns
+from af2_schema import load_af2_table
+from plddt_density import DENSITY_CACHE_PATH, group_densities, load_densities
+
+DATA_PATH = 'AF2_48_model_oganisms.parquet'
+BOX_SUMMARY_PATH = 'plddt_box_summary.json'
+BOXPLOT_NAME = 'new_plddt_boxplot_no_legend_yaxisswitch_setframethickness_14_8_thick4_111424'
+KDE_NAME = 'new_plddt_density_plot_no_legend_no_tranparency_setframethickness_0_110tick4_111424'
+DPI = 700
+# Outliers drawn per group; at markersize 0.3 more points only add rendering time
+MAX_FLIERS = 2000
+
+custom_palettes = {
+    "Protist": "#FEE127",
+    "Viridiplantae": "#0eb519",
+    "Fungi": "#F68A21",
+    "Animalia": "#E41E26",
+    "Bacteria": "#3D5BA9",
+    "Archaea": "#787979"
+}
+custom_order = ["Archaea", "Bacteria", "Fungi", "Animalia", "Viridiplantae", "Protist"]
+
+
+def box_summary(values, whis=(5, 95), max_fliers=MAX_FLIERS, rng=None):
+    """
+    Statistics for one box of matplotlib's Axes.bxp, as sns.boxplot(whis=(5, 95)) computes them.
+
+    Fliers are the values outside the whiskers; at most max_fliers of them are kept (a random
+    subset that always includes the minimum and maximum).
+    """
+    rng = np.random.default_rng(0) if rng is None else rng
+    values = np.asarray(values, dtype=np.float64)
+    values = values[~np.isnan(values)]
+    q1, med, q3 = np.percentile(values, [25, 50, 75])
+    whislo, whishi = np.percentile(values, whis)
+    fliers = values[(values < whislo) | (values > whishi)]
+    if len(fliers) > max_fliers:
+        extremes = [fliers.min(), fliers.max()]
+        fliers = np.concatenate([extremes, rng.choice(fliers, max_fliers - 2, replace=False)])
+    return {'med': med, 'q1': q1, 'q3': q3, 'whislo': whislo, 'whishi': whishi,
+            'fliers': fliers.tolist(), 'n': len(values)}
+
+
+def compute_box_summaries(df, value_col='plddt', group_col='superkindom', max_fliers=MAX_FLIERS):
+    rng = np.random.default_rng(0)
+    return {str(group): box_summary(values.to_numpy(), max_fliers=max_fliers, rng=rng)
+            for group, values in df.groupby(group_col, observed=True)[value_col]}
+
+
+def save_box_summaries(summaries, path=BOX_SUMMARY_PATH):
+    with open(path, 'w') as json_file:
+        json.dump(summaries, json_file)
+
+
+def load_box_summaries(path=BOX_SUMMARY_PATH):
+    with open(path, 'r') as json_file:
+        return json.load(json_file)
+
+
+def _seaborn_colors(groups, saturation=0.75):
+    """Box face colours and the shared line gray the way seaborn's boxplot derives them."""
+    colors = [sns.desaturate(custom_palettes[group], saturation) for group in groups]
+    lum = min(colorsys.rgb_to_hls(*color)[1] for color in colors) * .6
+    return colors, matplotlib.colors.rgb2hex((lum, lum, lum))
+
+
+def draw_boxplot(summaries, output_path):
+    """Horizontal pLDDT box plot per superkingdom, styled as in Bar_superkingdoms.py."""
+    groups = [group for group in custom_order if group in summaries]
+    colors, gray = _seaborn_colors(groups)
+    plt.figure(figsize=(14, 8), dpi=DPI)
+    ax = plt.gca()
+    line = dict(color=gray, linewidth=4)
+    flierprops = dict(marker='o', markerfacecolor='black', markeredgecolor=gray, markersize=0.3, linestyle='none')
+    boxes = ax.bxp([summaries[group] for group in groups], positions=range(len(groups)), vert=False, widths=0.7,
+                   patch_artist=True, boxprops=dict(edgecolor=gray, linewidth=4), medianprops=line,
+                   whiskerprops=line, capprops=line, flierprops=flierprops)
+    for box, color in zip(boxes['boxes'], colors):
+        box.set_facecolor(color)
+    # sns.boxplot puts the first category at the top
+    ax.set_ylim(len(groups) - 0.5, -0.5)
+    ax.yaxis.tick_right()
+    ax.yaxis.set_label_position('right')
+    plt.yticks([], [])
+    plt.xlabel("")
+    plt.ylabel("")
+    plt.xlim(20, 100)
+    plt.xticks([20, 40, 60, 80, 100], [])
+    plt.tick_params(axis='both', width=6, length=12)
+    sns.despine(left=True, right=False, top=True)
+    for spine in ('right', 'top', 'bottom', 'left'):
+        ax.spines[spine].set_linewidth(6)
+    plt.savefig(output_path, dpi=DPI)
+    plt.close()
+
+
+def draw_kde(densities, output_path):
+    """Per-superkingdom pLDDT KDE curves, styled as in KDE_superkingdoms.py."""
+    plt.figure(figsize=(12, 8), dpi=DPI)
+    # Viridiplantae is drawn last so that it sits on top of the other curves
+    for group in sorted(densities, key=lambda group: group == 'Viridiplantae'):
+        plt.plot(densities[group]['grid'], densities[group]['density'], color=custom_palettes[group],
+                 linewidth=4, alpha=1)
+    plt.xlabel('')
+    plt.ylabel('')
+    plt.xlim(0, 110)
+    plt.ylim(0, 0.1)
+    plt.xticks([0, 20, 40, 60, 80, 100], [])
+    plt.yticks([0, 0.02, 0.04, 0.06, 0.08, 0.1], [])
+    plt.tick_params(axis='both', width=3, length=6)
+    sns.despine()
+    ax = plt.gca()
+    for spine in ('left', 'right', 'top', 'bottom'):
+        ax.spines[spine].set_linewidth(3)
+    plt.savefig(output_path, dpi=DPI)
+    plt.close()
+
+
+def build_summaries(data_path=DATA_PATH):
+    """Recompute the box and KDE summaries from the row-level table."""
+    df = load_af2_table(data_path, columns=['superkindom', 'plddt'])
+    summaries = compute_box_summaries(df)
+    save_box_summaries(summaries)
+    return summaries, group_densities(df)
+
+
+def _modified_time(path):
+    """Last modification time of a file, or of the newest file under a directory (a partitioned table)."""
+    if not os.path.isdir(path):
+        return os.path.getmtime(path)
+    times = [os.path.getmtime(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names]
+    return max(times, default=os.path.getmtime(path))
+
+
+def summaries_are_stale(data_path=DATA_PATH, summary_paths=(BOX_SUMMARY_PATH, DENSITY_CACHE_PATH)):
+    """True if a summary file is missing or older than the row-level table it was computed from."""
+    if not all(os.path.exists(path) for path in summary_paths):
+        return True
+    if not os.path.exists(data_path):
+        return False
+    return min(os.path.getmtime(path) for path in summary_paths) < _modified_time(data_path)
+
+
+def load_summaries(data_path=DATA_PATH, refresh=False):
+    """
+    Box and KDE summaries for the figures, rebuilt from data_path only if refresh is set or they are stale.
+
+    Returns:
+        tuple: (box summaries as from compute_box_summaries, densities as from group_densities).
+    """
+    if refresh or summaries_are_stale(data_path):
+        print(f"Recomputing the figure summaries from {data_path}")
+        return build_summaries(data_path)
+    return load_box_summaries(), load_densities()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the superkingdom pLDDT figures from precomputed summaries.")
+    parser.add_argument('--data', default=DATA_PATH,
+                        help="Row-level table used to (re)compute the summaries.")
+    parser.add_argument('--refresh', action='store_true',
+                        help="Recompute the summaries even if they are newer than the table.")
+    parser.add_argument('--formats', nargs='+', default=['png'], help="Output formats, e.g. png svg.")
+    args = parser.parse_args()
+
+    summaries, densities = load_summaries(args.data, args.refresh)
+
+    for fmt in args.formats:
+        draw_boxplot(summaries, f"{BOXPLOT_NAME}.{fmt}")
+        draw_kde(densities, f"{KDE_NAME}.{fmt}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,19 @@
 #/home/soumajit/sda/LYX/EXTRACT_AF2_Info/extract_AF2_model_organisms/extract_AF2_48_model_organisms.py
 #564,446 entries were extracted from 48 model organisms. Same as summarized in https://academic.oup.com/nar/article/52/D1/D368/7337620
 
+import argparse
+import json
+import os
 import tarfile
-import gzip
 import io
-import pandas as pd
+from collections import deque
+from functools import partial
+from multiprocessing import Pool
+import pyarrow as pa
+import pyarrow.parquet as pq
+from af2_per_residue import STORE_DTYPES, combine_stores, to_store_dtype, write_store
+from af2_schema import AF2_SCHEMA, rows_to_record_batch, superkingdom_of
+from mmcif_fields import CIF_FIELDS, PER_RESIDUE_FIELDS, read_cif_gz_fields
 
 # Paths to local .tar files
 tar_file_paths =[
@@ -25,88 +34,267 @@ tar_file_paths =[
 'UP000001584_83332_MYCTU_v4.tar',   'UP000007841_1125630_KLEPH_v4.tar',   'UP000274756_318479_DRAME_v4.tar',
 'UP000001631_447093_AJECG_v4.tar',  'UP000008153_5671_LEIIN_v4.tar',      'UP000325664_1352_ENTFC_v4.tar']
 
-# Function to parse the CIF file and extract the desired information
-def extract_cif_info(cif_content):
-    extracted_info = {}
-    lines = cif_content.split('\n')
-    i = 0
-    while i < len(lines):
-        line = lines[i].strip()
-
-        if '_struct_ref_seq.pdbx_PDB_id_code' in line:
-            extracted_info['pdbx_PDB_id_code'] = line.split()[-1]
-        elif '_ma_target_ref_db_details.db_accession' in line:
-            extracted_info['db_accession'] = line.split()[-1]
-        elif '_ma_target_ref_db_details.db_code' in line:
-            extracted_info['db_code'] = line.split()[-1]
-        elif '_ma_target_ref_db_details.gene_name' in line:
-            extracted_info['gene_name'] = line.split()[-1]
-        elif '_ma_target_ref_db_details.ncbi_taxonomy_id' in line:
-            extracted_info['ncbi_taxonomy_id'] = line.split()[-1]
-        elif '_ma_target_ref_db_details.seq_db_sequence_checksum' in line:
-            extracted_info['EMBI_EBI_sequence_checksum'] = line.split()[-1]
-        elif '_ma_qa_metric_global.metric_value' in line:
-            extracted_info['plddt'] = line.split()[-1]
-        elif '_entity_poly.pdbx_seq_one_letter_code' in line and '_can' not in line:
-            # Check if the sequence starts on the same line or on the next line
-            parts = line.split()
-            if len(parts) > 1 and parts[-1] != '_entity_poly.pdbx_seq_one_letter_code':
-                # Single-line sequence
-                sequence = ''.join(parts[1:])
-                extracted_info['AAseq_one_letter_code'] = sequence
-            elif parts[-1] == '_entity_poly.pdbx_seq_one_letter_code':
-                # Multiline sequence
-                sequence = ''
-                i += 1
-                while lines[i].strip() != ';':
-                    sequence += lines[i].strip()
-                    i += 1
-                extracted_info['AAseq_one_letter_code'] = sequence
-        elif '_ma_target_ref_db_details.organism_scientific' in line:
-            organism_name_parts = line.split()[1:]
-            organism_name = ' '.join(organism_name_parts).strip('"')
-            extracted_info['organism_scientific'] = organism_name
-        elif '_ma_template_ref_db_details.template_id' in line:
-            i += 1
-            template_ids = []
-            while i < len(lines) and lines[i].strip() and not lines[i].startswith('#'):
-                parts = lines[i].split()
-                template_id = parts[0]
-                template_ids.append(template_id)
-                i += 1
-            extracted_info['template_ids'] = template_ids
-
-        i += 1
-    return extracted_info
-
-total_info = []
-
-for tar_file_path in tar_file_paths:
+MANIFEST_NAME = 'manifest.json'
+# Structures per record batch / Parquet row group
+BATCH_SIZE = 10000
+# Blocks submitted to the pool but not yet written, per worker (block mode)
+BLOCKS_IN_FLIGHT_PER_WORKER = 2
+
+def parse_cif_gz(gz_bytes, fields=None):
+    """Decompress one .cif.gz member and extract its header fields."""
+    return read_cif_gz_fields(io.BytesIO(gz_bytes), fields)
+
+def iter_cif_members(tar_file_path):
+    """
+    Stream the .cif.gz members of a tarball without indexing the whole archive.
+
+    Yields:
+        tuple: (member name, compressed member bytes).
+    """
+    with tarfile.open(tar_file_path, 'r|') as tar:
+        for member in tar:
+            if member.isfile() and member.name.endswith('.cif.gz'):
+                f = tar.extractfile(member)
+                if f is not None:
+                    yield member.name, f.read()
+
+def process_tarball(tar_file_path, output_dir, per_residue=None):
+    """
+    Worker for the one-tarball-per-process mode: parse one tarball and write its part file(s).
+
+    Returns:
+        tuple: (tar_file_path, number of structures, part file names or None, error message or None).
+    """
     try:
-        with tarfile.open(tar_file_path, 'r') as tar:
-            for member in tar.getmembers():
-                if member.name.endswith('.cif.gz'):
-                    f = tar.extractfile(member)
-                    if f is not None:
-                        with gzip.open(io.BytesIO(f.read()), 'rt') as gz:
-                            cif_content = gz.read()
-                            info = extract_cif_info(cif_content)
-                            total_info.append(info)
-        print(f"{tar_file_path} finished processing")
+        results = iter_tarball_batches(tar_file_path, per_residue=per_residue)
+        part_files, member_count = write_part(results, tar_file_path, output_dir, per_residue)
     except Exception as e:
-        print(f"Error processing {tar_file_path}: {e}")
+        return tar_file_path, 0, None, str(e)
+    return tar_file_path, member_count, part_files, None
+
+def _to_outputs(rows, superkindom, per_residue):
+    """Split parsed rows into a typed record batch and, in per_residue mode, (accession, profile) pairs."""
+    batch = rows_to_record_batch(rows, superkindom)
+    if per_residue is None:
+        return batch, None
+    profiles = [(row.get('db_accession'), to_store_dtype(row.get('plddt_local', []), per_residue)) for row in rows]
+    return batch, profiles
+
+def iter_tarball_batches(tar_file_path, batch_size=BATCH_SIZE, per_residue=None):
+    """Parse a tarball into (record batch, profiles) pairs of batch_size structures."""
+    superkindom = superkingdom_of(tar_file_path)
+    fields = CIF_FIELDS if per_residue is None else PER_RESIDUE_FIELDS
+    rows = []
+    for _, gz_bytes in iter_cif_members(tar_file_path):
+        rows.append(parse_cif_gz(gz_bytes, fields))
+        if len(rows) == batch_size:
+            yield _to_outputs(rows, superkindom, per_residue)
+            rows = []
+    if rows:
+        yield _to_outputs(rows, superkindom, per_residue)
+
+def parse_member_block(block, superkindom=None, per_residue=None):
+    """Worker for the block mode: parse a list of compressed members into one (record batch, profiles) pair."""
+    fields = CIF_FIELDS if per_residue is None else PER_RESIDUE_FIELDS
+    return _to_outputs([parse_cif_gz(gz_bytes, fields) for gz_bytes in block], superkindom, per_residue)
+
+def iter_member_blocks(tar_file_path, block_size):
+    """Group the compressed members of one tarball into blocks of block_size."""
+    block = []
+    for _, gz_bytes in iter_cif_members(tar_file_path):
+        block.append(gz_bytes)
+        if len(block) == block_size:
+            yield block
+            block = []
+    if block:
+        yield block
+
+def bounded_imap(pool, func, iterable, max_in_flight):
+    """
+    pool.imap with backpressure: at most max_in_flight items are submitted and not yet consumed.
+
+    Pool.imap's feeder thread drains the input iterator as fast as it can, so a whole tarball's
+    compressed members would pile up in the parent; here the next block is read only when a result
+    has been taken. Results come back in input order.
+    """
+    in_flight = deque()
+    for item in iterable:
+        in_flight.append(pool.apply_async(func, (item,)))
+        if len(in_flight) >= max_in_flight:
+            yield in_flight.popleft().get()
+    while in_flight:
+        yield in_flight.popleft().get()
+
+def part_file_name(tar_file_path):
+    return os.path.basename(tar_file_path).replace('.tar', '.parquet')
+
+def per_residue_part_name(tar_file_path):
+    return os.path.basename(tar_file_path).replace('.tar', '_plddt')
+
+def write_part(results, tar_file_path, output_dir, per_residue=None):
+    """
+    Stream record batches into one tarball's part file. The file only appears once it is complete.
+    In per_residue mode the profiles are written to a per-tarball store next to it.
+
+    Returns:
+        tuple: (dict of part file names, number of rows written).
+    """
+    part_file = part_file_name(tar_file_path)
+    tmp_path = os.path.join(output_dir, part_file + '.tmp')
+    num_rows = 0
+    accessions, profiles = [], []
+    try:
+        with pq.ParquetWriter(tmp_path, AF2_SCHEMA) as writer:
+            for batch, batch_profiles in results:
+                writer.write_batch(batch)
+                num_rows += batch.num_rows
+                if batch_profiles:
+                    accessions.extend(accession for accession, _ in batch_profiles)
+                    profiles.extend(profile for _, profile in batch_profiles)
+        part_files = {'output_file': part_file}
+        if per_residue is not None:
+            part_files['per_residue_file'] = per_residue_part_name(tar_file_path)
+            write_store(os.path.join(output_dir, part_files['per_residue_file']), accessions, profiles, per_residue)
+    except BaseException:
+        # A failed worker or writer must not leave a half-written part behind
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, os.path.join(output_dir, part_file))
+    return part_files, num_rows
 
-processed_info = []
+def tarball_signature(tar_file_path):
+    stat = os.stat(tar_file_path)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime}
 
-for element in total_info:
-    processed_element = {}
-    for key, value in element.items():
-        if isinstance(value, list):
-            processed_element[key] = ', '.join(map(str, value))
+def load_manifest(output_dir):
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, 'r') as json_file:
+        return json.load(json_file)
+
+def save_manifest(manifest, output_dir):
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    with open(manifest_path + '.tmp', 'w') as json_file:
+        json.dump(manifest, json_file, indent=4)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+def is_up_to_date(manifest, tar_file_path, output_dir, per_residue=None):
+    """True if tar_file_path was processed before, has not changed since, and its part file(s) still exist."""
+    entry = manifest.get(os.path.abspath(tar_file_path))
+    if entry is None or not os.path.exists(tar_file_path):
+        return False
+    outputs = ['output_file'] if per_residue is None else ['output_file', 'per_residue_file']
+    if per_residue is not None and entry.get('per_residue_dtype') != per_residue:
+        return False
+    signature = tarball_signature(tar_file_path)
+    return (entry['size'] == signature['size'] and entry['mtime'] == signature['mtime']
+            and all(key in entry and os.path.exists(os.path.join(output_dir, entry[key])) for key in outputs))
+
+def extract_all(tar_paths, output_dir, workers=1, block_size=None, per_residue=None):
+    """
+    Extract the header fields of every .cif.gz member in tar_paths into one Parquet part file per tarball.
+
+    A manifest (tar path, size, mtime, member count, output file) is updated after every finished
+    tarball, and tarballs whose size and mtime match the manifest are skipped, so an interrupted or
+    refreshed run only redoes the new, modified or failed tarballs.
+
+    Args:
+        tar_paths (list): Paths to the AlphaFold proteome tarballs.
+        output_dir (str): Directory for the part files and the manifest.
+        workers (int): Number of worker processes. 1 runs everything in this process.
+        block_size (int): If set, split each tarball into blocks of this many members
+            and hand the blocks to the workers instead of whole tarballs. Useful when
+            a few large proteomes (e.g. HUMAN, SOYBN) dominate the run time.
+        per_residue (str): If set ('float16' or 'uint8'), also extract per-residue pLDDT from
+            _ma_qa_metric_local into a per-tarball af2_per_residue store of that dtype.
+
+    Returns:
+        dict: The manifest.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = load_manifest(output_dir)
+    todo = []
+    for tar_file_path in tar_paths:
+        if is_up_to_date(manifest, tar_file_path, output_dir, per_residue):
+            print(f"{tar_file_path} unchanged, skipping")
+        else:
+            todo.append(tar_file_path)
+
+    def record(tar_file_path, member_count, part_files, error):
+        if error is not None:
+            print(f"Error processing {tar_file_path}: {error}")
+            return
+        entry = {'tar_path': os.path.abspath(tar_file_path), 'member_count': member_count}
+        entry.update(part_files)
+        if per_residue is not None:
+            entry['per_residue_dtype'] = per_residue
+        entry.update(tarball_signature(tar_file_path))
+        manifest[entry['tar_path']] = entry
+        save_manifest(manifest, output_dir)
+        print(f"{tar_file_path} finished processing")
+
+    if block_size is None:
+        worker = partial(process_tarball, output_dir=output_dir, per_residue=per_residue)
+        if workers <= 1:
+            for result in map(worker, todo):
+                record(*result)
         else:
-            processed_element[key] = value
-    processed_info.append(processed_element)
+            with Pool(workers) as pool:
+                for result in pool.imap_unordered(worker, todo):
+                    record(*result)
+        return manifest
+
+    # Block mode: only compressed bytes travel to the workers, decompression and parsing happen there.
+    with Pool(workers) as pool:
+        for tar_file_path in todo:
+            worker = partial(parse_member_block, superkindom=superkingdom_of(tar_file_path), per_residue=per_residue)
+            try:
+                results = bounded_imap(pool, worker, iter_member_blocks(tar_file_path, block_size),
+                                       BLOCKS_IN_FLIGHT_PER_WORKER * workers)
+                part_files, member_count = write_part(results, tar_file_path, output_dir, per_residue)
+            except Exception as e:
+                record(tar_file_path, 0, None, str(e))
+                continue
+            record(tar_file_path, member_count, part_files, None)
+    return manifest
+
+def _part_paths(tar_paths, output_dir, key):
+    manifest = load_manifest(output_dir)
+    return [os.path.join(output_dir, manifest[os.path.abspath(p)][key])
+            for p in tar_paths if key in manifest.get(os.path.abspath(p), {})]
+
+def combine_parts(tar_paths, output_dir, output_file):
+    """Concatenate the part files of tar_paths into the single table used by the analysis scripts."""
+    table = pa.concat_tables([pq.read_table(p) for p in _part_paths(tar_paths, output_dir, 'output_file')])
+    pq.write_table(table, output_file)
+    return table
+
+def combine_per_residue_parts(tar_paths, output_dir, output_path):
+    """Concatenate the per-tarball pLDDT stores into one memory-mappable store."""
+    combine_stores(_part_paths(tar_paths, output_dir, 'per_residue_file'), output_path)
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract AF2 header fields from the 48 model organism proteome tarballs.")
+    parser.add_argument('--workers', type=int, default=1, help="Number of worker processes.")
+    parser.add_argument('--block-size', type=int, default=None,
+                        help="Members per work unit. Default: one tarball per worker.")
+    parser.add_argument('--output-dir', default='AF2_48_model_oganisms_parts',
+                        help="Directory for the per-tarball part files and the manifest.")
+    parser.add_argument('--output', default='AF2_48_model_oganisms.parquet',
+                        help="Combined table written from the part files.")
+    parser.add_argument('--per-residue', choices=STORE_DTYPES, default=None,
+                        help="Also extract per-residue pLDDT, stored with this dtype.")
+    parser.add_argument('--per-residue-output', default='AF2_48_model_oganisms_per_residue_plddt',
+                        help="Combined per-residue pLDDT store.")
+    args = parser.parse_args()
+
+    extract_all(tar_file_paths, args.output_dir, workers=args.workers, block_size=args.block_size,
+                per_residue=args.per_residue)
+    combine_parts(tar_file_paths, args.output_dir, args.output)
+    if args.per_residue is not None:
+        combine_per_residue_parts(tar_file_paths, args.output_dir, args.per_residue_output)
 
-# Create DataFrame from the processed list of dictionaries
-df = pd.DataFrame(processed_info)
-df.to_parquet('AF2_48_model_oganisms.parquet')
+if __name__ == "__main__":
+    main()
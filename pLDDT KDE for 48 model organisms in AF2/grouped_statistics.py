@@ -0,0 +1,140 @@
+#This file contains the grouped pLDDT statistics used in Statistical_analysis.py.
+#The table is partitioned by superkingdom once (one stable sort), and every statistic is computed
+#from contiguous slices of that order. Kruskal-Wallis and Dunn share a single global ranking,
+#so adding organisms or groups adds one slice each instead of another pass over the full frame.
+from itertools import combinations
+import numpy as np
+import pandas as pd
+import scipy.stats as stats
+from plddt_density import DENSITY_CACHE_PATH, group_densities
+
+PLDDT_THRESHOLD = 70
+
+
+def partition(df, group_col='superkindom', columns=('plddt',)):
+    """
+    Sort the requested columns by group once.
+
+    Returns:
+        tuple: (group labels, boundaries array of len(labels) + 1, dict column -> sorted float64 array).
+        Rows of group labels[i] are [boundaries[i], boundaries[i + 1]) in every array.
+    """
+    codes, labels = pd.factorize(df[group_col], sort=True)
+    keep = codes >= 0
+    order = np.argsort(codes[keep], kind='stable')
+    counts = np.bincount(codes[keep], minlength=len(labels))
+    boundaries = np.concatenate([[0], np.cumsum(counts)])
+    arrays = {column: df[column].to_numpy(dtype=np.float64)[keep][order] for column in columns}
+    return list(labels), boundaries, arrays
+
+
+def _tie_sum(ranked_values):
+    """sum(t^3 - t) over groups of tied values."""
+    _, tie_counts = np.unique(ranked_values, return_counts=True)
+    tie_counts = tie_counts[tie_counts > 1].astype(np.float64)
+    return float(np.sum(tie_counts ** 3 - tie_counts))
+
+
+def kruskal_dunn(values, boundaries, labels, p_adjust='bonferroni'):
+    """
+    Kruskal-Wallis H test and Dunn's pairwise post-hoc test from one ranking of the partitioned values.
+    Matches scipy.stats.kruskal and scikit_posthocs.posthoc_dunn (including tie corrections).
+
+    Args:
+        values (numpy.ndarray): Values sorted by group, as returned by partition.
+        boundaries (numpy.ndarray): Group boundaries from partition.
+        labels (list): Group labels from partition.
+        p_adjust (str): 'bonferroni' or None.
+
+    Returns:
+        tuple: (H statistic, Kruskal-Wallis p-value, DataFrame with one row per group pair:
+        group_a, group_b, z, p, p_adj).
+    """
+    n_total = len(values)
+    ranks = stats.rankdata(values)
+    counts = np.diff(boundaries).astype(np.float64)
+    rank_sums = np.add.reduceat(ranks, boundaries[:-1])
+    tie_sum = _tie_sum(values)
+
+    h = 12.0 / (n_total * (n_total + 1)) * np.sum(rank_sums ** 2 / counts) - 3 * (n_total + 1)
+    h /= 1 - tie_sum / (n_total ** 3 - n_total)
+    kruskal_p = stats.chi2.sf(h, len(labels) - 1)
+
+    mean_ranks = rank_sums / counts
+    variance = n_total * (n_total + 1) / 12.0 - tie_sum / (12.0 * (n_total - 1))
+    pairs = []
+    for i, j in combinations(range(len(labels)), 2):
+        z = (mean_ranks[i] - mean_ranks[j]) / np.sqrt(variance * (1 / counts[i] + 1 / counts[j]))
+        pairs.append({'group_a': labels[i], 'group_b': labels[j], 'z': z, 'p': 2 * stats.norm.sf(abs(z))})
+    dunn = pd.DataFrame(pairs, columns=['group_a', 'group_b', 'z', 'p'])
+    if p_adjust == 'bonferroni':
+        dunn['p_adj'] = np.minimum(dunn['p'] * len(dunn), 1.0)
+    else:
+        dunn['p_adj'] = dunn['p']
+    return h, kruskal_p, dunn
+
+
+def grouped_plddt_statistics(df, value_col='plddt', length_col='sequence_length', group_col='superkindom',
+                             threshold=PLDDT_THRESHOLD, density_cache_path=DENSITY_CACHE_PATH):
+    """
+    Per-group pLDDT statistics in one pass over the partitioned table.
+
+    For every group: n, mean, 2.5/97.5 percentiles, percentage >= threshold (percent_gte_70 by
+    default), KDE peaks, and Pearson/Spearman correlation of value_col with length_col.
+    Kruskal-Wallis across all groups is added as two constant columns; Dunn's pairwise test is
+    returned separately.
+
+    Missing values are dropped per statistic: the pLDDT statistics use every row with a pLDDT, the
+    correlations only the rows that also have a length (their count is n_correlation). The peaks are
+    read from the plddt_density group cache, so they are the same as the ones in the KDE figure.
+
+    Args:
+        df (pandas.DataFrame): Row-level table, e.g. from af2_schema.load_af2_table.
+        value_col (str): pLDDT column.
+        length_col (str): Sequence length column (None to skip the correlations).
+        group_col (str): Grouping column.
+        threshold (float): Cut-off for the percent_gte_<threshold> column.
+        density_cache_path (str): Cache file of plddt_density.group_densities, or None to disable caching.
+
+    Returns:
+        tuple: (summary DataFrame with one row per group, Dunn DataFrame with one row per group pair).
+    """
+    columns = [value_col] if length_col is None else [value_col, length_col]
+    missing = int(df[value_col].isna().sum())
+    if missing:
+        print(f"{missing} of {len(df)} rows have no {value_col} and are left out")
+    df = df.dropna(subset=[value_col])
+    labels, boundaries, arrays = partition(df, group_col, columns)
+    values = arrays[value_col]
+    densities = group_densities(df, value_col, group_col, cache_path=density_cache_path)
+
+    rows = []
+    for i, group in enumerate(labels):
+        start, end = boundaries[i], boundaries[i + 1]
+        group_values = values[start:end]
+        low, high = np.percentile(group_values, [2.5, 97.5])
+        row = {
+            'superkingdom': group,
+            'n': end - start,
+            'mean_plddt': group_values.mean(),
+            'percentile_2_5': low,
+            'percentile_97_5': high,
+            f'percent_gte_{threshold:g}': 100.0 * np.count_nonzero(group_values >= threshold) / len(group_values),
+            'peaks': densities[group]['peaks'],
+        }
+        if length_col is not None:
+            group_lengths = arrays[length_col][start:end]
+            has_length = ~np.isnan(group_lengths)
+            if not has_length.all():
+                print(f"{group}: {int((~has_length).sum())} rows have no {length_col} and are left out of the correlations")
+            group_lengths, group_values = group_lengths[has_length], group_values[has_length]
+            row['n_correlation'] = len(group_values)
+            row['pearson_corr'], row['pearson_p'] = stats.pearsonr(group_lengths, group_values)
+            row['spearman_corr'], row['spearman_p'] = stats.spearmanr(group_lengths, group_values)
+        rows.append(row)
+
+    summary = pd.DataFrame(rows)
+    h, kruskal_p, dunn = kruskal_dunn(values, boundaries, labels)
+    summary['kruskal_H'] = h
+    summary['kruskal_p'] = kruskal_p
+    return summary, dunn
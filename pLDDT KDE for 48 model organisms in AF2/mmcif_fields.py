@@ -0,0 +1,203 @@
+#This file contains a byte-level reader for the header fields of AlphaFold mmCIF files.
+#It replaces the line-splitting extract_cif_info that used to live in extract_AF2_48_model_organisms.py:
+#instead of decoding the whole file and testing every line, it jumps to the categories it needs,
+#tokenizes only those blocks and stops decompressing as soon as all of them have been read.
+import re
+import zlib
+
+# (category, item) -> output key. Keys are the column names of AF2_48_model_oganisms.parquet.
+CIF_FIELDS = {
+    ('_ma_target_ref_db_details', 'db_accession'): 'db_accession',
+    ('_ma_target_ref_db_details', 'db_code'): 'db_code',
+    ('_ma_target_ref_db_details', 'gene_name'): 'gene_name',
+    ('_ma_target_ref_db_details', 'ncbi_taxonomy_id'): 'ncbi_taxonomy_id',
+    ('_ma_target_ref_db_details', 'organism_scientific'): 'organism_scientific',
+    ('_ma_target_ref_db_details', 'seq_db_sequence_checksum'): 'EMBI_EBI_sequence_checksum',
+    ('_ma_qa_metric_global', 'metric_value'): 'plddt',
+    ('_entity_poly', 'pdbx_seq_one_letter_code'): 'AAseq_one_letter_code',
+    ('_ma_template_ref_db_details', 'db_accession_code'): 'template_ids',
+    ('_struct_ref_seq', 'pdbx_PDB_id_code'): 'pdbx_PDB_id_code',
+}
+# Header fields plus the per-residue pLDDT loop, for the per_residue extraction mode
+PER_RESIDUE_FIELDS = dict(CIF_FIELDS)
+PER_RESIDUE_FIELDS[('_ma_qa_metric_local', 'metric_value')] = 'plddt_local'
+# Keys that hold every row of a loop instead of the first value
+LIST_FIELDS = {'template_ids', 'plddt_local'}
+
+# mmCIF tokens: ;-delimited text fields (must start a line), quoted strings, bare words
+_TOKEN = re.compile(rb"""
+    ^;(?P<text>.*?)\n;
+  | '(?P<single>[^\n]*?)'(?=\s|$)
+  | "(?P<double>[^\n]*?)"(?=\s|$)
+  | (?P<bare>\S+)
+""", re.M | re.S | re.X)
+
+_CHUNK_SIZE = 1 << 16
+# AlphaFold files write the coordinate loop after every header category
+_STOP_MARKER = b'\n_atom_site.'
+
+
+def _tokenize(block):
+    """Return (is_tag, value) pairs for one category block."""
+    tokens = []
+    for match in _TOKEN.finditer(block):
+        bare = match.group('bare')
+        if bare is not None:
+            tokens.append((bare.startswith(b'_') or bare == b'loop_', bare))
+        elif match.group('text') is not None:
+            tokens.append((False, match.group('text')))
+        elif match.group('single') is not None:
+            tokens.append((False, match.group('single')))
+        else:
+            tokens.append((False, match.group('double')))
+    return tokens
+
+
+def parse_category(block):
+    """
+    Parse one mmCIF category block, in either key-value or loop_ form.
+
+    Args:
+        block (bytes): The block, from its first tag up to (not including) the closing '#' line.
+
+    Returns:
+        dict: item name (bytes, without the category prefix) -> list of values (bytes).
+    """
+    tokens = _tokenize(block)
+    items = {}
+    if tokens and tokens[0][1] == b'loop_':
+        tags = []
+        i = 1
+        while i < len(tokens) and tokens[i][0]:
+            tags.append(tokens[i][1].split(b'.', 1)[-1])
+            i += 1
+        values = [value for _, value in tokens[i:]]
+        for column, tag in enumerate(tags):
+            items[tag] = values[column::len(tags)]
+        return items
+
+    i = 0
+    while i + 1 < len(tokens):
+        is_tag, tag = tokens[i]
+        if not is_tag:
+            i += 1
+            continue
+        items[tag.split(b'.', 1)[-1]] = [tokens[i + 1][1]]
+        i += 2
+    return items
+
+
+def _find_block(buf, category, final):
+    """
+    Locate a category block in buf.
+
+    Returns:
+        tuple: (start, end) of the block, (start, None) if the block has started but its closing
+        '#' line has not been read yet, or (None, None) if the category is not in buf.
+    """
+    if buf.startswith(category + b'.'):
+        start = 0
+    else:
+        start = buf.find(b'\n' + category + b'.')
+        if start == -1:
+            return None, None
+        start += 1
+    if buf[max(0, start - 6):start] == b'loop_\n':
+        start -= 6
+    # AlphaFold files close every category with a '#' line
+    end = buf.find(b'\n#', start)
+    if end == -1:
+        return start, (len(buf) if final else None)
+    return start, end
+
+
+def _to_output(category, items, fields):
+    info = {}
+    for (field_category, item), key in fields.items():
+        if field_category != category:
+            continue
+        values = items.get(item.encode())
+        if not values:
+            continue
+        values = [value.decode('utf-8', 'replace') for value in values]
+        if key in LIST_FIELDS:
+            info[key] = values
+        elif key == 'AAseq_one_letter_code':
+            info[key] = ''.join(values[0].split())
+        else:
+            info[key] = values[0]
+    return info
+
+
+def _scan(buf, pending, found, fields, final):
+    """Parse every pending category that is complete in buf; return how much of buf can be dropped."""
+    keep_from = max(0, len(buf) - 128)
+    for category in list(pending):
+        start, end = _find_block(buf, category, final)
+        if start is None:
+            continue
+        if end is None:
+            # Keep the newline before the block too, so that it is found again on the next call
+            keep_from = min(keep_from, max(0, start - 1))
+            continue
+        items = parse_category(buf[start:end])
+        found.update(_to_output(category.decode(), items, fields))
+        pending.discard(category)
+    return keep_from
+
+
+def _categories(fields):
+    return {category.encode() for category, _ in fields}
+
+
+def extract_cif_fields(cif_bytes, fields=None):
+    """
+    Extract header fields from an uncompressed mmCIF file.
+
+    Args:
+        cif_bytes (bytes): The file content.
+        fields (dict): Subset of CIF_FIELDS to extract. Defaults to all of them.
+
+    Returns:
+        dict: Output key -> value (str), or list of str for LIST_FIELDS.
+    """
+    fields = CIF_FIELDS if fields is None else fields
+    found = {}
+    _scan(cif_bytes, _categories(fields), found, fields, final=True)
+    return found
+
+
+def read_cif_gz_fields(fileobj, fields=None, chunk_size=_CHUNK_SIZE):
+    """
+    Extract header fields from a gzip-compressed mmCIF stream.
+
+    Decompression is incremental and stops as soon as every requested category has been
+    parsed, or once the _atom_site loop begins after the header (a category still missing then
+    is not in the file), so the coordinate loops are never inflated. Only the unparsed tail of
+    the decompressed data is kept in memory.
+
+    Args:
+        fileobj: Binary file object with the .cif.gz content (e.g. from tar.extractfile()).
+        fields (dict): Subset of CIF_FIELDS to extract. Defaults to all of them.
+        chunk_size (int): Compressed bytes read per step.
+
+    Returns:
+        dict: Output key -> value (str), or list of str for LIST_FIELDS.
+    """
+    fields = CIF_FIELDS if fields is None else fields
+    pending = _categories(fields)
+    found = {}
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    buf = b''
+    while pending:
+        chunk = fileobj.read(chunk_size)
+        if not chunk:
+            buf += decompressor.flush()
+            _scan(buf, pending, found, fields, final=True)
+            break
+        buf += decompressor.decompress(chunk)
+        keep_from = _scan(buf, pending, found, fields, final=False)
+        if pending and _STOP_MARKER in buf:
+            break
+        buf = buf[keep_from:]
+    return found